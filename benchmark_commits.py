@@ -0,0 +1,70 @@
+"""Benchmark booking confirmations with group commit against one durable write per booking.
+
+Runs in a temporary directory with freshly generated sample data, so the bot's own Excel
+files are not touched.
+
+Usage: python benchmark_commits.py [confirmations]
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import next_flight
+
+logging.getLogger(next_flight.__name__).setLevel(logging.WARNING)
+
+def reset_files():
+    """Start every run from the same sample data."""
+    next_flight.create_flights_excel()
+    next_flight.create_bookings_excel()
+    next_flight.migrate_seat_maps()
+
+def booking_args(flights, i):
+    """Arguments for the i-th confirmation, spread over all sample flights."""
+    flight = flights.iloc[i % len(flights)]
+    return (flight['Date'], flight['Time'], flight['Flight Number'], 1000 + i, f"user{i}", 1, None, next_flight.DEFAULT_BASE_FARE)
+
+def one_write_per_booking(confirmations, flights):
+    """Confirm bookings one at a time, each with its own write of both files."""
+    start = time.perf_counter()
+    for i in range(confirmations):
+        args = booking_args(flights, i)
+        [(ok, result)] = next_flight.apply_changes([lambda tables: next_flight.reserve_booking(tables, *args)])
+        assert ok, result
+    return confirmations / (time.perf_counter() - start)
+
+async def group_commit(confirmations, flights):
+    """Confirm bookings concurrently through the group committer."""
+    next_flight.commit_queue = asyncio.Queue()
+    committer = asyncio.create_task(next_flight.group_committer())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        next_flight.commit_change(next_flight.reserve_booking, *booking_args(flights, i))
+        for i in range(confirmations)
+    ))
+    elapsed = time.perf_counter() - start
+
+    committer.cancel()
+    return confirmations / elapsed
+
+def main():
+    confirmations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    os.chdir(tempfile.mkdtemp())
+
+    reset_files()
+    flights = next_flight.load_tables()['flights']
+
+    baseline = one_write_per_booking(confirmations, flights)
+    reset_files()
+    batched = asyncio.run(group_commit(confirmations, flights))
+
+    print(f"Confirmations: {confirmations}")
+    print(f"One write per booking: {baseline:8.1f} confirmations/s")
+    print(f"Group commit:          {batched:8.1f} confirmations/s ({batched / baseline:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,22 @@
+import asyncio
+import functools
+import glob
+import hashlib
+import heapq
 import logging
 import os
-from datetime import datetime, timedelta
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, time as dt_time, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden, NetworkError, RetryAfter, TelegramError
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
     filters, ContextTypes, ConversationHandler
 )
+import numpy as np
 import pandas as pd
 import openpyxl
 from openpyxl import load_workbook, Workbook
@@ -21,59 +32,133 @@ logger = logging.getLogger(__name__)
 # Excel file paths
 FLIGHTS_FILE = 'flights.xlsx'
 BOOKINGS_FILE = 'bookings.xlsx'
+FLIGHTS_HEADERS = ["Date", "Time", "Flight Number", "Departure", "Destination", "Capacity", "Booked", "Seat Map", "Base Fare"]
+BOOKINGS_HEADERS = ["Date", "Time", "Flight Number", "User ID", "Username", "Booking Time", "Passengers", "Seats", "Fare", "Reminded"]
+
+# Departed flights and their bookings are moved nightly into compressed monthly partitions
+ARCHIVE_DIR = 'archive'
+ARCHIVE_TIME = dt_time(hour=3)
 
 # Admin user IDs (replace with actual admin Telegram IDs)
 ADMIN_USERS = [123456789]
 
 # Conversation states
-SELECTING_DATE, SELECTING_FLIGHT, CONFIRMING_BOOKING, ADMIN_ADDING_FLIGHT = range(4)
+(
+    SELECTING_DATE, SELECTING_FLIGHT, SELECTING_SEATS, PICKING_SEAT, CONFIRMING_BOOKING, ADMIN_ADDING_FLIGHT
+) = range(6)
 
 # Callback data prefixes
 DATE_PREFIX = "date:"
 FLIGHT_PREFIX = "flight:"
+SEATS_PREFIX = "seats:"
+SEAT_PREFIX = "seat:"
+SEAT_PAGE_PREFIX = "seatpage:"
 CONFIRM_PREFIX = "confirm:"
 CANCEL_PREFIX = "cancel:"
 ADMIN_PREFIX = "admin:"
 
-# Create sample flights Excel file with realistic data
-def create_flights_excel():
-    """Create a sample flights Excel file with realistic flight data."""
-    # Create a new workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Flights"
-    
-    # Add headers with styling
-    headers = ["Date", "Time", "Flight Number", "Departure", "Destination", "Capacity", "Booked"]
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
-        cell.alignment = Alignment(horizontal="center")
-    
-    # Generate sample flight data
-    # Use the next 7 days for flights
+# Largest group that can be booked in a single booking
+MAX_SEATS_PER_BOOKING = 10
+
+# Seat layout: seats are numbered row by row (1A, 1B, ... 1F, 2A, ...) and stored as a bitmap
+SEAT_LETTERS = "ABCDEF"
+SEATS_PER_ROW = len(SEAT_LETTERS)
+SEAT_PICKER_ROWS = 8  # rows shown per page of the seat picker
+
+# Fares: base fare x load factor multiplier x days-to-departure multiplier
+CURRENCY = "$"
+DEFAULT_BASE_FARE = 100
+LOAD_BUCKETS = 10  # load factor is priced in steps of 10%
+LOAD_FARE_MULTIPLIERS = np.array([0.80, 0.85, 0.90, 0.95, 1.00, 1.10, 1.20, 1.35, 1.50, 1.75, 2.00])
+DAYS_OUT_THRESHOLDS = np.array([3, 7, 14, 30])  # <3 days, 3-6, 7-13, 14-29, 30+
+DAYS_OUT_FARE_MULTIPLIERS = np.array([1.50, 1.30, 1.15, 1.00, 0.90])
+
+# Outbound notification throttling (Telegram allows roughly 30 messages per second per bot)
+NOTIFICATIONS_PER_SECOND = 25
+NOTIFICATION_WORKERS = 4
+NOTIFICATION_MAX_RETRIES = 3
+NOTIFICATION_BACKOFF = 1.0  # seconds, doubled on every retry
+
+# Departure reminders
+REMINDER_HOURS = 24
+REMINDER_CHECK_INTERVAL = 60  # seconds
+
+# Group commit: flush queued writes every COMMIT_INTERVAL seconds or COMMIT_BATCH_SIZE changes
+COMMIT_INTERVAL = 0.005
+COMMIT_BATCH_SIZE = 64
+
+# Queue of (mutation, future) pairs drained by group_committer, created in post_init
+commit_queue = None
+commit_task = None
+
+# Queue of (chat_id, text) messages drained by the notification workers, created in post_init
+notification_queue = None
+notification_tasks = []
+next_send_slot = 0.0
+# Loop time until which all sends are paused after Telegram's flood control answered with RetryAfter
+send_paused_until = 0.0
+
+# Booking integrity: flights changed since the last check are verified every INTEGRITY_CHECK_INTERVAL
+# seconds; the last INTEGRITY_LOG_SIZE repairs are kept for /integrity
+INTEGRITY_CHECK_INTERVAL = 30
+INTEGRITY_LOG_SIZE = 20
+
+# Admin report
+REPORT_HOURS = 24
+REPORT_RECENT_HOURS = 6
+REPORT_TOP_N = 5
+
+# On-demand profiling
+PROFILE_INTERVAL = 0.005  # seconds between stack samples
+MAX_PROFILE_SECONDS = 300
+PROFILE_TOP_N = 30
+
+# Min-heap of (send_at, reminder key) plus the currently scheduled send time of each key
+reminder_heap = []
+reminder_index = {}
+
+# Report aggregates keyed by flight, by (departure, destination) route and by booking hour
+flight_stats = {}
+route_stats = {}
+hourly_bookings = Counter()
+
+# Fare quotes keyed by flight: (load bucket, days to departure, base fare, fare)
+fare_cache = {}
+
+# Running profiling session started by /profile, None when profiling is off
+profiling = None
+
+# Per-flight (booked seats, seat checksum) derived from the booking records and the flights changed
+# since the last integrity check; both are updated from the committer thread under ledger_lock
+booking_ledger = {}
+dirty_flights = set()
+ledger_lock = threading.Lock()
+full_audit_pending = False
+integrity_status = {'last_audit': None, 'last_check': None, 'flights_checked': 0, 'orphan_bookings': 0, 'conflicts': []}
+integrity_repairs = deque(maxlen=INTEGRITY_LOG_SIZE)
+
+# Sample flight data for the next 7 days
+def sample_flights():
+    """Return rows of realistic sample flights, in FLIGHTS_HEADERS order."""
     start_date = datetime.now().date()
     flight_data = []
     
     # Flight routes
     routes = [
-        {"flight": "FL101", "departure": "New York", "destination": "London", "capacity": 120},
-        {"flight": "FL102", "departure": "London", "destination": "New York", "capacity": 120},
-        {"flight": "FL203", "departure": "Paris", "destination": "Tokyo", "capacity": 180},
-        {"flight": "FL204", "departure": "Tokyo", "destination": "Paris", "capacity": 180},
-        {"flight": "FL305", "departure": "Dubai", "destination": "Sydney", "capacity": 150},
-        {"flight": "FL306", "departure": "Sydney", "destination": "Dubai", "capacity": 150},
-        {"flight": "FL407", "departure": "Singapore", "destination": "San Francisco", "capacity": 200},
-        {"flight": "FL408", "departure": "San Francisco", "destination": "Singapore", "capacity": 200}
+        {"flight": "FL101", "departure": "New York", "destination": "London", "capacity": 120, "fare": 450},
+        {"flight": "FL102", "departure": "London", "destination": "New York", "capacity": 120, "fare": 450},
+        {"flight": "FL203", "departure": "Paris", "destination": "Tokyo", "capacity": 180, "fare": 780},
+        {"flight": "FL204", "departure": "Tokyo", "destination": "Paris", "capacity": 180, "fare": 780},
+        {"flight": "FL305", "departure": "Dubai", "destination": "Sydney", "capacity": 150, "fare": 690},
+        {"flight": "FL306", "departure": "Sydney", "destination": "Dubai", "capacity": 150, "fare": 690},
+        {"flight": "FL407", "departure": "Singapore", "destination": "San Francisco", "capacity": 200, "fare": 820},
+        {"flight": "FL408", "departure": "San Francisco", "destination": "Singapore", "capacity": 200, "fare": 820}
     ]
     
     # Flight times
     times = ["06:30", "08:45", "11:15", "13:30", "16:00", "19:45", "22:30"]
     
     # Generate flights for each day
-    row_num = 2  # Start from row 2 (after header)
     for day_offset in range(7):
         flight_date = start_date + timedelta(days=day_offset)
         date_str = flight_date.strftime("%Y-%m-%d")
@@ -82,22 +167,43 @@ def create_flights_excel():
         daily_routes = routes[day_offset % 4:day_offset % 4 + 4]
         
         for route in daily_routes:
-            # Add 2-3 time slots per route per day
+            # Add 2-3 time slots per route per day, starting with 0 bookings
             for time in times[day_offset % 3:day_offset % 3 + 3]:
-                # Add data to worksheet
-                ws.cell(row=row_num, column=1).value = date_str
-                ws.cell(row=row_num, column=2).value = time
-                ws.cell(row=row_num, column=3).value = route["flight"]
-                ws.cell(row=row_num, column=4).value = route["departure"]
-                ws.cell(row=row_num, column=5).value = route["destination"]
-                ws.cell(row=row_num, column=6).value = route["capacity"]
-                ws.cell(row=row_num, column=7).value = 0  # Start with 0 bookings
-                
-                # Center align all cells except departure and destination
-                for col in [1, 2, 3, 6, 7]:
-                    ws.cell(row=row_num, column=col).alignment = Alignment(horizontal="center")
-                
-                row_num += 1
+                flight_data.append([
+                    date_str, time, route["flight"], route["departure"], route["destination"],
+                    route["capacity"], 0, seat_map_to_hex(empty_seat_map(route["capacity"])), route["fare"]
+                ])
+    
+    return flight_data
+
+# Create sample flights Excel file with realistic data
+def create_flights_excel():
+    """Create a sample flights Excel file with realistic flight data."""
+    # Create a new workbook
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Flights"
+    
+    # Add headers with styling
+    headers = FLIGHTS_HEADERS
+    for col_num, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col_num)
+        cell.value = header
+        cell.font = Font(bold=True)
+        cell.fill = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
+        cell.alignment = Alignment(horizontal="center")
+    
+    # Add data to worksheet
+    row_num = 2  # Start from row 2 (after header)
+    for flight in sample_flights():
+        for col_num, value in enumerate(flight, 1):
+            ws.cell(row=row_num, column=col_num).value = value
+        
+        # Center align all cells except departure and destination
+        for col in [1, 2, 3, 6, 7, 9]:
+            ws.cell(row=row_num, column=col).alignment = Alignment(horizontal="center")
+        
+        row_num += 1
     
     # Adjust column widths
     column_widths = {
@@ -107,7 +213,9 @@ def create_flights_excel():
         "D": 20,  # Departure
         "E": 20,  # Destination
         "F": 10,  # Capacity
-        "G": 10   # Booked
+        "G": 10,  # Booked
+        "H": 20,  # Seat Map
+        "I": 10   # Base Fare
     }
     
     for col, width in column_widths.items():
@@ -136,7 +244,7 @@ def create_bookings_excel():
     ws.title = "Bookings"
     
     # Add headers with styling
-    headers = ["Date", "Time", "Flight Number", "User ID", "Username", "Booking Time"]
+    headers = BOOKINGS_HEADERS
     for col_num, header in enumerate(headers, 1):
         cell = ws.cell(row=1, column=col_num)
         cell.value = header
@@ -151,7 +259,11 @@ def create_bookings_excel():
         "C": 15,  # Flight Number
         "D": 12,  # User ID
         "E": 20,  # Username
-        "F": 20   # Booking Time
+        "F": 20,  # Booking Time
+        "G": 12,  # Passengers
+        "H": 20,  # Seats
+        "I": 10,  # Fare
+        "J": 10   # Reminded
     }
     
     for col, width in column_widths.items():
@@ -179,6 +291,105 @@ def ensure_excel_files_exist():
     if not os.path.exists(BOOKINGS_FILE):
         create_bookings_excel()
 
+# Group commit
+# All writes to the Excel files go through a single committer task. Handlers queue a storage
+# mutation (a function that changes the loaded tables in place) and await its durability; the
+# committer gathers mutations for up to COMMIT_INTERVAL seconds or COMMIT_BATCH_SIZE changes,
+# applies them in order to one copy of the tables and writes and fsyncs each file once per batch.
+class RejectedChange(Exception):
+    """Raised by a storage mutation to refuse a change; the message is shown to the user."""
+
+def load_tables():
+    """Load the flights and bookings tables for a batch of mutations."""
+    flights_df = pd.read_excel(FLIGHTS_FILE)
+    # An unreadable date is kept as it is, so that writing the file back does not lose it
+    dates = pd.to_datetime(flights_df['Date'], errors='coerce')
+    flights_df['Date'] = dates.dt.strftime("%Y-%m-%d").where(dates.notna(), flights_df['Date'])
+    return {'flights': flights_df, 'bookings': pd.read_excel(BOOKINGS_FILE)}
+
+def write_excel_durably(df, path):
+    """Atomically replace an Excel file and fsync it, so readers never see a partial file."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        df.to_excel(f, index=False, engine='openpyxl')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+    # The rename itself is only durable once the directory entry is on disk
+    fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def apply_changes(changes):
+    """Apply a batch of mutations and write both files once; returns (ok, result) per mutation."""
+    tables = load_tables()
+    results = []
+
+    for change in changes:
+        try:
+            results.append((True, change(tables)))
+        except Exception as e:
+            # Mutations check everything before touching the tables, so a failure changes nothing
+            results.append((False, e))
+
+    if any(ok for ok, _ in results):
+        write_excel_durably(tables['bookings'], BOOKINGS_FILE)
+        write_excel_durably(tables['flights'], FLIGHTS_FILE)
+        update_ledger(tables)
+
+    return results
+
+async def commit_change(mutation, *args):
+    """Queue a storage mutation and wait until it has been written to disk; returns its result."""
+    future = asyncio.get_running_loop().create_future()
+    commit_queue.put_nowait((lambda tables: mutation(tables, *args), future))
+    return await future
+
+async def group_committer():
+    """Apply queued mutations in batches, one write and fsync per file per batch."""
+    global full_audit_pending
+    loop = asyncio.get_running_loop()
+
+    while True:
+        batch = [await commit_queue.get()]
+        deadline = loop.time() + COMMIT_INTERVAL
+
+        while len(batch) < COMMIT_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(commit_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Run the file I/O in a thread so that handlers keep running while the batch is written
+        try:
+            results = await asyncio.to_thread(apply_changes, [change for change, _ in batch])
+        except Exception as e:
+            logger.error(f"Error writing batch of {len(batch)} changes: {e}")
+            results = [(False, e)] * len(batch)
+            # One of the files may have been written without the other
+            full_audit_pending = True
+
+        for (_, future), (ok, result) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+def recreate_tables(tables):
+    """Storage mutation replacing all flights and bookings with fresh sample data."""
+    tables['flights'] = pd.DataFrame(sample_flights(), columns=FLIGHTS_HEADERS)
+    tables['bookings'] = pd.DataFrame(columns=BOOKINGS_HEADERS)
+    tables['ledger_reset'] = {}
+    tables['ledger_changes'] = []
+
 # Command to manually recreate the Excel files (admin only)
 async def recreate_excel_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Recreate Excel files with sample data (admin only)."""
@@ -189,13 +400,255 @@ async def recreate_excel_files(update: Update, context: ContextTypes.DEFAULT_TYP
     
     try:
         # Recreate files
-        create_flights_excel()
-        create_bookings_excel()
+        await commit_change(recreate_tables)
+        build_reminder_heap()
+        build_report_stats()
         await update.message.reply_text("✅ Excel files recreated successfully with sample data.")
     except Exception as e:
         logger.error(f"Error recreating Excel files: {e}")
         await update.message.reply_text(f"Error recreating Excel files: {e}")
 
+# Seat maps
+# Each flight stores its occupied seats as a bitmap (bit i set = seat i taken), one bit per seat,
+# so a 200-seat flight needs 25 bytes. The bitmap is kept hex-encoded in the "Seat Map" column
+# (with a 0x prefix, otherwise pandas reads an all-digit map back as a number) and Booked is
+# always its population count.
+def empty_seat_map(capacity):
+    """Return a seat map with all seats free."""
+    return bytearray((int(capacity) + 7) // 8)
+
+def seat_map_to_hex(seat_map):
+    """Encode a seat map for the "Seat Map" column."""
+    return f"0x{seat_map.hex()}"
+
+def seat_map_from_hex(value, capacity):
+    """Decode a flight's "Seat Map" cell, treating a missing map as all seats free."""
+    if not isinstance(value, str) or not value.startswith("0x"):
+        return empty_seat_map(capacity)
+    return bytearray.fromhex(value[2:])
+
+def flight_seat_map(flight):
+    """Return the seat map of a flight row."""
+    return seat_map_from_hex(flight.get('Seat Map'), flight['Capacity'])
+
+def occupied_seats(seat_map):
+    """Return the number of occupied seats."""
+    return int.from_bytes(seat_map, 'little').bit_count()
+
+def seat_taken(seat_map, seat):
+    """Return True if a seat is occupied."""
+    return bool(seat_map[seat >> 3] & (1 << (seat & 7)))
+
+def occupy_seats(seat_map, seats):
+    """Mark seats as occupied."""
+    for seat in seats:
+        seat_map[seat >> 3] |= 1 << (seat & 7)
+
+def release_seats(seat_map, seats):
+    """Mark seats as free."""
+    for seat in seats:
+        seat_map[seat >> 3] &= ~(1 << (seat & 7)) & 0xFF
+
+def seat_label(seat):
+    """Return the label of a seat index, e.g. 0 -> 1A."""
+    return f"{seat // SEATS_PER_ROW + 1}{SEAT_LETTERS[seat % SEATS_PER_ROW]}"
+
+def format_seats(seats):
+    """Format seat indexes for the "Seats" column, e.g. [0, 1] -> "1A,1B"."""
+    return ",".join(seat_label(seat) for seat in seats)
+
+def split_seats(value, capacity=None):
+    """Split a "Seats" cell into seat indexes and the labels that are not valid seats (of the flight)."""
+    if not isinstance(value, str) or not value:
+        return [], []
+    seats = []
+    invalid = []
+    for label in value.split(","):
+        label = label.strip()
+        if not label:
+            continue
+        row, letter = label[:-1], label[-1].upper()
+        if not row.isdigit() or int(row) < 1 or letter not in SEAT_LETTERS:
+            invalid.append(label)
+            continue
+        seat = (int(row) - 1) * SEATS_PER_ROW + SEAT_LETTERS.index(letter)
+        if capacity is not None and seat >= int(capacity):
+            invalid.append(label)
+            continue
+        seats.append(seat)
+    return seats, invalid
+
+def parse_seats(value, capacity=None):
+    """Parse a "Seats" cell back into seat indexes, skipping (and logging) invalid or out-of-range labels."""
+    seats, invalid = split_seats(value, capacity)
+    if invalid:
+        logger.warning(f"Ignoring invalid seats {', '.join(invalid)} in {value!r}")
+    return seats
+
+@functools.lru_cache(maxsize=None)
+def row_block_starts(capacity, count):
+    """Bitmask of the seats where a block of `count` adjacent seats fits within one row."""
+    mask = 0
+    for seat in range(capacity - count + 1):
+        if seat % SEATS_PER_ROW + count <= SEATS_PER_ROW:
+            mask |= 1 << seat
+    return mask
+
+def find_free_seats(seat_map, capacity, count):
+    """Find seats for a group: adjacent seats in one row if possible, else any free seats.
+
+    Returns None if fewer than `count` seats are free.
+    """
+    capacity = int(capacity)
+    free = ~int.from_bytes(seat_map, 'little') & ((1 << capacity) - 1)
+    if free.bit_count() < count:
+        return None
+
+    # Bit i of `block` is set when seats i .. i+count-1 are all free
+    block = free
+    for shift in range(1, count):
+        block &= free >> shift
+
+    for starts in (block & row_block_starts(capacity, count), block):
+        if starts:
+            first = (starts & -starts).bit_length() - 1
+            return list(range(first, first + count))
+
+    # No adjacent block left: take the lowest free seats
+    seats = []
+    while len(seats) < count:
+        seats.append((free & -free).bit_length() - 1)
+        free &= free - 1
+    return seats
+
+def seat_block(seat_map, capacity, first, count):
+    """Return the `count` adjacent seats starting at `first` if they are free and in one row."""
+    seats = list(range(first, first + count))
+    if seats[-1] >= int(capacity):
+        return None
+    if count <= SEATS_PER_ROW and first % SEATS_PER_ROW + count > SEATS_PER_ROW:
+        return None
+    if any(seat_taken(seat_map, seat) for seat in seats):
+        return None
+    return seats
+
+def migrate_seat_maps():
+    """Give flights created before seat selection a seat map and their bookings seat numbers."""
+    flights_df = pd.read_excel(FLIGHTS_FILE)
+    bookings_df = pd.read_excel(BOOKINGS_FILE)
+
+    if 'Seat Map' not in flights_df.columns:
+        flights_df['Seat Map'] = ""
+    if 'Seats' not in bookings_df.columns:
+        bookings_df['Seats'] = ""
+
+    flights_df['Seat Map'] = flights_df['Seat Map'].fillna("").astype(str)
+    bookings_df['Seats'] = bookings_df['Seats'].fillna("").astype(str)
+
+    flight_dates = pd.to_datetime(flights_df['Date']).dt.strftime("%Y-%m-%d")
+    flight_index = {
+        flight_key(date_str, time_str, flight_number): index
+        for index, date_str, time_str, flight_number in zip(
+            flights_df.index, flight_dates, flights_df['Time'], flights_df['Flight Number']
+        )
+    }
+    booking_flights = [
+        flight_index.get(flight_key(date_str, time_str, flight_number))
+        for date_str, time_str, flight_number in zip(
+            bookings_df['Date'], bookings_df['Time'], bookings_df['Flight Number']
+        )
+    ]
+
+    # Bookings whose flight no longer exists cannot be given seats and are left alone
+    missing_maps = ~flights_df['Seat Map'].str.startswith("0x")
+    missing_seats = (bookings_df['Seats'] == "") & pd.Series(
+        [index is not None for index in booking_flights], index=bookings_df.index, dtype=bool
+    )
+    if not missing_maps.any() and not missing_seats.any():
+        return
+
+    # Flights without a map are rebuilt from the seats their bookings already hold
+    seat_maps = {
+        index: (empty_seat_map(flights_df.at[index, 'Capacity']) if missing_maps[index]
+                else flight_seat_map(flights_df.loc[index]))
+        for index in flights_df.index
+    }
+    for (booking_index, booking), index in zip(bookings_df.iterrows(), booking_flights):
+        if index is not None and missing_maps[index] and not missing_seats[booking_index]:
+            occupy_seats(seat_maps[index], parse_seats(booking['Seats'], flights_df.at[index, 'Capacity']))
+
+    # Then bookings without seats get the next free ones
+    for (booking_index, booking), index in zip(bookings_df.iterrows(), booking_flights):
+        if index is None or not missing_seats[booking_index]:
+            continue
+        seats = find_free_seats(seat_maps[index], flights_df.at[index, 'Capacity'], passenger_count(booking))
+        if seats is None:
+            logger.warning(f"No free seats left for booking {booking_index} on flight {booking['Flight Number']}")
+            continue
+        occupy_seats(seat_maps[index], seats)
+        bookings_df.at[booking_index, 'Seats'] = format_seats(seats)
+
+    for index, seat_map in seat_maps.items():
+        flights_df.at[index, 'Seat Map'] = seat_map_to_hex(seat_map)
+        flights_df.at[index, 'Booked'] = occupied_seats(seat_map)
+
+    write_excel_durably(bookings_df, BOOKINGS_FILE)
+    write_excel_durably(flights_df, FLIGHTS_FILE)
+    logger.info("Migrated flights and bookings to seat maps")
+
+# Fares
+def load_buckets(flights_df):
+    """Return each flight's load factor bucket (0 = empty ... LOAD_BUCKETS = full)."""
+    load = flights_df['Booked'].to_numpy(dtype=float) / flights_df['Capacity'].to_numpy(dtype=float)
+    return np.clip(np.floor(load * LOAD_BUCKETS), 0, LOAD_BUCKETS).astype(int)
+
+def days_to_departure(flights_df):
+    """Return the number of days until each flight departs."""
+    today = pd.Timestamp(datetime.now().date())
+    return (pd.to_datetime(flights_df['Date']) - today).dt.days.clip(lower=0).to_numpy()
+
+def base_fares(flights_df):
+    """Return each flight's base fare, using DEFAULT_BASE_FARE where none is set."""
+    if 'Base Fare' not in flights_df.columns:
+        return np.full(len(flights_df), float(DEFAULT_BASE_FARE))
+    return pd.to_numeric(flights_df['Base Fare'], errors='coerce').fillna(DEFAULT_BASE_FARE).to_numpy(dtype=float)
+
+def price_flights(base, buckets, days):
+    """Price a set of flights in one vectorized pass; returns whole-currency fares."""
+    load_multiplier = LOAD_FARE_MULTIPLIERS[buckets]
+    days_multiplier = DAYS_OUT_FARE_MULTIPLIERS[np.searchsorted(DAYS_OUT_THRESHOLDS, days, side='right')]
+    return np.round(base * load_multiplier * days_multiplier).astype(int)
+
+def quote_fares(flights_df):
+    """Return the current fare of each flight, served from the quote cache where possible.
+
+    A cached quote stays valid until the flight moves to another load bucket (or another day
+    before departure, or its base fare changes, e.g. when a removed flight is added again);
+    all flights needing a new quote are priced together in one pass.
+    """
+    buckets = load_buckets(flights_df)
+    days = days_to_departure(flights_df)
+    base = base_fares(flights_df)
+    dates = pd.to_datetime(flights_df['Date']).dt.strftime("%Y-%m-%d")
+    keys = [
+        flight_key(date_str, time_str, flight_number)
+        for date_str, time_str, flight_number in zip(
+            dates.tolist(), flights_df['Time'].tolist(), flights_df['Flight Number'].tolist()
+        )
+    ]
+    states = list(zip(buckets.tolist(), days.tolist(), base.tolist()))
+
+    stale = [
+        position for position, (key, state) in enumerate(zip(keys, states))
+        if fare_cache.get(key, (None,))[:3] != state
+    ]
+    if stale:
+        prices = price_flights(base[stale], buckets[stale], days[stale])
+        for position, price in zip(stale, prices.tolist()):
+            fare_cache[keys[position]] = (*states[position], price)
+
+    return pd.Series([fare_cache[key][3] for key in keys], index=flights_df.index)
+
 # Command handlers
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
@@ -215,7 +668,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         message += "\nAdmin Commands:\n"
         message += "/add_flight - Add a new flight\n"
         message += "/remove_flight - Remove a flight\n"
+        message += "/force_remove_flight - Remove a flight and cancel its bookings\n"
+        message += "/cancel_route - Cancel all flights on a route\n"
+        message += "/cancel_dates - Cancel all flights in a date range\n"
         message += "/download_bookings - Download bookings data\n"
+        message += "/report - Load factor and booking velocity report\n"
+        message += "/profile - Profile the bot for a number of seconds\n"
+        message += "/integrity - Booking integrity audit and repairs\n"
         message += "/recreate_excel - Recreate Excel files with sample data\n"
     
     await update.message.reply_text(message)
@@ -241,12 +700,15 @@ async def book_flight_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return ConversationHandler.END
         
         unique_dates = sorted(available_flights['Date'].unique())
+        lowest_fares = quote_fares(available_flights).groupby(available_flights['Date']).min()
         
-        # Create keyboard with dates
+        # Create keyboard with dates and the lowest fare on each
         keyboard = []
         for date in unique_dates:
             date_str = date.strftime("%Y-%m-%d")
-            keyboard.append([InlineKeyboardButton(date_str, callback_data=f"{DATE_PREFIX}{date_str}")])
+            keyboard.append([InlineKeyboardButton(
+                f"{date_str} (from {CURRENCY}{lowest_fares[date]})", callback_data=f"{DATE_PREFIX}{date_str}"
+            )])
         
         # Add cancel button
         keyboard.append([InlineKeyboardButton("Cancel", callback_data="cancel")])
@@ -270,7 +732,10 @@ async def select_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("Booking cancelled.")
         return ConversationHandler.END
     
-    selected_date = query.data.replace(DATE_PREFIX, "")
+    return await show_flights(query, context, query.data.replace(DATE_PREFIX, ""))
+
+async def show_flights(query, context: ContextTypes.DEFAULT_TYPE, selected_date):
+    """Show the available flights on a date for an already answered callback query."""
     context.user_data['selected_date'] = selected_date
     
     try:
@@ -288,9 +753,10 @@ async def select_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return ConversationHandler.END
         
         # Create keyboard with flights
+        fares = quote_fares(available_flights)
         keyboard = []
-        for _, flight in available_flights.iterrows():
-            flight_info = f"{flight['Time']} - {flight['Flight Number']} - {flight['Departure']} to {flight['Destination']} ({flight['Available']} seats)"
+        for index, flight in available_flights.iterrows():
+            flight_info = f"{flight['Time']} - {flight['Flight Number']} - {flight['Departure']} to {flight['Destination']} ({flight['Available']} seats, {CURRENCY}{fares[index]})"
             flight_data = f"{flight['Time']}|{flight['Flight Number']}"
             keyboard.append([InlineKeyboardButton(flight_info, callback_data=f"{FLIGHT_PREFIX}{flight_data}")])
         
@@ -309,12 +775,12 @@ async def select_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return SELECTING_FLIGHT
     
     except Exception as e:
-        logger.error(f"Error in select_date: {e}")
+        logger.error(f"Error in show_flights: {e}")
         await query.edit_message_text(f"Error retrieving flights: {e}")
         return ConversationHandler.END
 
 async def select_flight(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle flight selection and ask for confirmation."""
+    """Handle flight selection and ask for the number of passengers."""
     query = update.callback_query
     await query.answer()
     
@@ -343,13 +809,167 @@ async def select_flight(update: Update, context: ContextTypes.DEFAULT_TYPE):
             (df['Flight Number'] == flight_number)
         ].iloc[0]
         
+        context.user_data['selected_route'] = f"{flight_details['Departure']} to {flight_details['Destination']}"
+        context.user_data['fare'] = int(quote_fares(flight_details.to_frame().T).iloc[0])
+        available = int(flight_details['Capacity'] - flight_details['Booked'])
+        
+        # Create passenger count keyboard, five buttons per row
+        counts = [
+            InlineKeyboardButton(str(count), callback_data=f"{SEATS_PREFIX}{count}")
+            for count in range(1, min(MAX_SEATS_PER_BOOKING, available) + 1)
+        ]
+        keyboard = [counts[i:i + 5] for i in range(0, len(counts), 5)]
+        keyboard.append([
+            InlineKeyboardButton("« Back", callback_data=f"{DATE_PREFIX}{context.user_data['selected_date']}"),
+            InlineKeyboardButton("Cancel", callback_data="cancel")
+        ])
+        
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(
+            f"Flight {flight_number} on {context.user_data['selected_date']} at {flight_time}\n"
+            f"Route: {context.user_data['selected_route']}\n"
+            f"Fare: {CURRENCY}{context.user_data['fare']} per passenger\n\n"
+            f"How many passengers? ({available} seats left)",
+            reply_markup=reply_markup
+        )
+        
+        return SELECTING_SEATS
+    
+    except Exception as e:
+        logger.error(f"Error in select_flight: {e}")
+        await query.edit_message_text(f"Error retrieving flight details: {e}")
+        return ConversationHandler.END
+
+async def select_seats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle passenger count selection and show the seat picker."""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.data == "cancel":
+        await query.edit_message_text("Booking cancelled.")
+        return ConversationHandler.END
+    
+    if query.data.startswith(DATE_PREFIX):
+        return await show_flights(query, context, query.data.replace(DATE_PREFIX, ""))
+    
+    context.user_data['passengers'] = int(query.data.replace(SEATS_PREFIX, ""))
+    context.user_data['selected_seats'] = None
+    
+    try:
+        return await show_seat_picker(query, context, 0)
+    except Exception as e:
+        logger.error(f"Error in select_seats: {e}")
+        await query.edit_message_text(f"Error retrieving seat map: {e}")
+        return ConversationHandler.END
+
+def load_selected_flight(context: ContextTypes.DEFAULT_TYPE):
+    """Return the row of the flight selected in the booking conversation, or None."""
+    flights_df = pd.read_excel(FLIGHTS_FILE)
+    flights_df['Date'] = pd.to_datetime(flights_df['Date']).dt.strftime("%Y-%m-%d")
+    flight_row = flights_df[
+        (flights_df['Date'] == context.user_data['selected_date']) & 
+        (flights_df['Time'] == context.user_data['selected_time']) & 
+        (flights_df['Flight Number'] == context.user_data['selected_flight'])
+    ]
+    return None if flight_row.empty else flight_row.iloc[0]
+
+async def show_seat_picker(query, context: ContextTypes.DEFAULT_TYPE, page, notice=""):
+    """Show one page of the seat map as a keyboard."""
+    flight = load_selected_flight(context)
+    if flight is None:
+        await query.edit_message_text("This flight is no longer available.")
+        return ConversationHandler.END
+    
+    capacity = int(flight['Capacity'])
+    seat_map = flight_seat_map(flight)
+    rows = (capacity + SEATS_PER_ROW - 1) // SEATS_PER_ROW
+    pages = (rows + SEAT_PICKER_ROWS - 1) // SEAT_PICKER_ROWS
+    context.user_data['seat_page'] = page
+    
+    # One keyboard row per seat row, taken seats shown as ✖
+    keyboard = []
+    for row in range(page * SEAT_PICKER_ROWS, min(rows, (page + 1) * SEAT_PICKER_ROWS)):
+        buttons = []
+        for seat in range(row * SEATS_PER_ROW, min(capacity, (row + 1) * SEATS_PER_ROW)):
+            if seat_taken(seat_map, seat):
+                buttons.append(InlineKeyboardButton("✖", callback_data=f"{SEAT_PREFIX}taken"))
+            else:
+                buttons.append(InlineKeyboardButton(seat_label(seat), callback_data=f"{SEAT_PREFIX}{seat}"))
+        keyboard.append(buttons)
+    
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("« Front", callback_data=f"{SEAT_PAGE_PREFIX}{page - 1}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("Rear »", callback_data=f"{SEAT_PAGE_PREFIX}{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    
+    keyboard.append([
+        InlineKeyboardButton("Any seats", callback_data=f"{SEAT_PREFIX}any"),
+        InlineKeyboardButton("Cancel", callback_data="cancel")
+    ])
+    
+    passengers = context.user_data['passengers']
+    if passengers == 1:
+        prompt = "Please select your seat (✖ = taken):"
+    else:
+        prompt = f"Please select the first of {passengers} adjacent seats (✖ = taken):"
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(f"{notice}{prompt}", reply_markup=reply_markup)
+    
+    return PICKING_SEAT
+
+async def pick_seat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle seat selection and ask for confirmation."""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.data == "cancel":
+        await query.edit_message_text("Booking cancelled.")
+        return ConversationHandler.END
+    
+    try:
+        page = context.user_data.get('seat_page', 0)
+        
+        if query.data.startswith(SEAT_PAGE_PREFIX):
+            return await show_seat_picker(query, context, int(query.data.replace(SEAT_PAGE_PREFIX, "")))
+        
+        choice = query.data.replace(SEAT_PREFIX, "")
+        if choice == "taken":
+            return await show_seat_picker(query, context, page, "That seat is already taken.\n\n")
+        
+        passengers = context.user_data['passengers']
+        if choice == "any":
+            # Seats are assigned when the booking is confirmed
+            context.user_data['selected_seats'] = None
+        else:
+            flight = load_selected_flight(context)
+            if flight is None:
+                await query.edit_message_text("This flight is no longer available.")
+                return ConversationHandler.END
+            
+            seats = seat_block(flight_seat_map(flight), flight['Capacity'], int(choice), passengers)
+            if seats is None:
+                return await show_seat_picker(
+                    query, context, page,
+                    f"There are not {passengers} free seats in a row from {seat_label(int(choice))}.\n\n"
+                )
+            context.user_data['selected_seats'] = seats
+        
+        seats = context.user_data['selected_seats']
+        
         # Create confirmation message
         confirmation_msg = (
             f"Please confirm your booking:\n\n"
             f"Date: {context.user_data['selected_date']}\n"
-            f"Time: {flight_time}\n"
-            f"Flight: {flight_number}\n"
-            f"Route: {flight_details['Departure']} to {flight_details['Destination']}"
+            f"Time: {context.user_data['selected_time']}\n"
+            f"Flight: {context.user_data['selected_flight']}\n"
+            f"Route: {context.user_data['selected_route']}\n"
+            f"Passengers: {passengers}\n"
+            f"Seats: {', '.join(seat_label(seat) for seat in seats) if seats else 'assigned automatically'}\n"
+            f"Fare: {CURRENCY}{context.user_data['fare']} x {passengers} = {CURRENCY}{context.user_data['fare'] * passengers}"
         )
         
         # Create confirmation keyboard
@@ -366,10 +986,84 @@ async def select_flight(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CONFIRMING_BOOKING
     
     except Exception as e:
-        logger.error(f"Error in select_flight: {e}")
-        await query.edit_message_text(f"Error retrieving flight details: {e}")
+        logger.error(f"Error in pick_seat: {e}")
+        await query.edit_message_text(f"Error selecting seats: {e}")
         return ConversationHandler.END
 
+def passenger_count(booking):
+    """Return the number of seats held by a booking (bookings made before group booking hold one)."""
+    passengers = booking.get('Passengers', 1)
+    return 1 if pd.isna(passengers) else int(passengers)
+
+def reserve_booking(tables, date_str, time_str, flight_number, user_id, username, passengers, selected_seats, fare):
+    """Storage mutation adding a booking for `passengers` seats; returns the reserved seats.
+
+    All seats are reserved or none are: every check happens before the tables are changed.
+    """
+    bookings_df = tables['bookings']
+    flights_df = tables['flights']
+    
+    # Check if user already has this booking
+    existing_booking = bookings_df[
+        (bookings_df['User ID'] == user_id) & 
+        (bookings_df['Date'] == date_str) & 
+        (bookings_df['Flight Number'] == flight_number)
+    ]
+    
+    if not existing_booking.empty:
+        raise RejectedChange("You have already booked this flight.")
+    
+    # Check if flight is still available
+    flight_row = flights_df[
+        (flights_df['Date'] == date_str) & 
+        (flights_df['Time'] == time_str) & 
+        (flights_df['Flight Number'] == flight_number)
+    ]
+    
+    if flight_row.empty:
+        raise RejectedChange("This flight is no longer available.")
+    
+    flight_index = flight_row.index[0]
+    capacity = flights_df.at[flight_index, 'Capacity']
+    seat_map = flight_seat_map(flights_df.loc[flight_index])
+    available = capacity - occupied_seats(seat_map)
+    if available <= 0:
+        raise RejectedChange("Sorry, this flight is now fully booked.")
+    if passengers > available:
+        raise RejectedChange(f"Sorry, only {available} seats are left on this flight.")
+    
+    if selected_seats:
+        if any(seat_taken(seat_map, seat) for seat in selected_seats):
+            raise RejectedChange(
+                "Sorry, some of the selected seats were just taken. Please use /book to choose again."
+            )
+        seats = selected_seats
+    else:
+        seats = find_free_seats(seat_map, capacity, passengers)
+    
+    # Add a single booking record for the whole group
+    new_booking = pd.DataFrame({
+        'Date': [date_str],
+        'Time': [time_str],
+        'Flight Number': [flight_number],
+        'User ID': [user_id],
+        'Username': [username],
+        'Booking Time': [datetime.now().strftime("%Y-%m-%d %H:%M:%S")],
+        'Passengers': [passengers],
+        'Seats': [format_seats(seats)],
+        'Fare': [fare * passengers],
+        'Reminded': [False]
+    })
+    tables['bookings'] = pd.concat([bookings_df, new_booking], ignore_index=True)
+    
+    # Update seat map and flight booking count
+    occupy_seats(seat_map, seats)
+    flights_df.at[flight_index, 'Seat Map'] = seat_map_to_hex(seat_map)
+    flights_df.at[flight_index, 'Booked'] = occupied_seats(seat_map)
+    record_seat_change(tables, flight_key(date_str, time_str, flight_number), seats, 1)
+    
+    return seats
+
 async def confirm_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle booking confirmation and save the booking."""
     query = update.callback_query
@@ -384,62 +1078,31 @@ async def confirm_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
         date_str = context.user_data['selected_date']
         time_str = context.user_data['selected_time']
         flight_number = context.user_data['selected_flight']
+        passengers = context.user_data.get('passengers', 1)
         user_id = update.effective_user.id
         username = update.effective_user.username or update.effective_user.first_name
-        booking_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        # Check if user already has this booking
-        bookings_df = pd.read_excel(BOOKINGS_FILE)
-        existing_booking = bookings_df[
-            (bookings_df['User ID'] == user_id) & 
-            (bookings_df['Date'] == date_str) & 
-            (bookings_df['Flight Number'] == flight_number)
-        ]
-        
-        if not existing_booking.empty:
-            await query.edit_message_text("You have already booked this flight.")
-            return ConversationHandler.END
         
-        # Check if flight is still available
-        flights_df = pd.read_excel(FLIGHTS_FILE)
-        flights_df['Date'] = pd.to_datetime(flights_df['Date']).dt.strftime("%Y-%m-%d")
-        flight_row = flights_df[
-            (flights_df['Date'] == date_str) & 
-            (flights_df['Time'] == time_str) & 
-            (flights_df['Flight Number'] == flight_number)
-        ]
-        
-        if flight_row.empty:
-            await query.edit_message_text("This flight is no longer available.")
-            return ConversationHandler.END
-        
-        flight_index = flight_row.index[0]
-        if flights_df.at[flight_index, 'Booked'] >= flights_df.at[flight_index, 'Capacity']:
-            await query.edit_message_text("Sorry, this flight is now fully booked.")
+        # Reply only once the booking is durably written
+        try:
+            seats = await commit_change(
+                reserve_booking, date_str, time_str, flight_number, user_id, username,
+                passengers, context.user_data.get('selected_seats'), context.user_data.get('fare')
+            )
+        except RejectedChange as e:
+            await query.edit_message_text(str(e))
             return ConversationHandler.END
         
-        # Add the booking
-        new_booking = pd.DataFrame({
-            'Date': [date_str],
-            'Time': [time_str],
-            'Flight Number': [flight_number],
-            'User ID': [user_id],
-            'Username': [username],
-            'Booking Time': [booking_time]
-        })
-        
-        bookings_df = pd.concat([bookings_df, new_booking], ignore_index=True)
-        bookings_df.to_excel(BOOKINGS_FILE, index=False)
-        
-        # Update flight booking count
-        flights_df.at[flight_index, 'Booked'] += 1
-        flights_df.to_excel(FLIGHTS_FILE, index=False)
+        schedule_reminder(user_id, date_str, time_str, flight_number)
+        record_booking_stats(flight_key(date_str, time_str, flight_number), datetime.now(), passengers)
         
         await query.edit_message_text(
             f"✅ Booking confirmed!\n\n"
             f"Date: {date_str}\n"
             f"Time: {time_str}\n"
-            f"Flight: {flight_number}\n\n"
+            f"Flight: {flight_number}\n"
+            f"Passengers: {passengers}\n"
+            f"Seats: {', '.join(seat_label(seat) for seat in seats)}\n"
+            f"Total fare: {CURRENCY}{context.user_data['fare'] * passengers}\n\n"
             f"You can view your bookings with /my_bookings"
         )
         
@@ -456,9 +1119,10 @@ async def my_bookings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     try:
-        # Read bookings
+        # Read bookings, skipping flights that have already departed
         bookings_df = pd.read_excel(BOOKINGS_FILE)
-        user_bookings = bookings_df[bookings_df['User ID'] == user_id]
+        today = datetime.now().strftime("%Y-%m-%d")
+        user_bookings = bookings_df[(bookings_df['User ID'] == user_id) & (bookings_df['Date'] >= today)]
         
         if user_bookings.empty:
             await update.message.reply_text("You don't have any bookings.")
@@ -483,13 +1147,17 @@ async def my_bookings(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     f"{index + 1}. Date: {booking['Date']}\n"
                     f"   Time: {booking['Time']}\n"
                     f"   Flight: {booking['Flight Number']}\n"
-                    f"   Route: {flight['Departure']} to {flight['Destination']}\n\n"
+                    f"   Route: {flight['Departure']} to {flight['Destination']}\n"
+                    f"   Passengers: {passenger_count(booking)}\n"
+                    f"   Seats: {booking.get('Seats', '')}\n\n"
                 )
             else:
                 message += (
                     f"{index + 1}. Date: {booking['Date']}\n"
                     f"   Time: {booking['Time']}\n"
-                    f"   Flight: {booking['Flight Number']}\n\n"
+                    f"   Flight: {booking['Flight Number']}\n"
+                    f"   Passengers: {passenger_count(booking)}\n"
+                    f"   Seats: {booking.get('Seats', '')}\n\n"
                 )
         
         await update.message.reply_text(message)
@@ -504,9 +1172,10 @@ async def cancel_booking_start(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = update.effective_user.id
     
     try:
-        # Read bookings
+        # Read bookings, skipping flights that have already departed
         bookings_df = pd.read_excel(BOOKINGS_FILE)
-        user_bookings = bookings_df[bookings_df['User ID'] == user_id]
+        today = datetime.now().strftime("%Y-%m-%d")
+        user_bookings = bookings_df[(bookings_df['User ID'] == user_id) & (bookings_df['Date'] >= today)]
         
         if user_bookings.empty:
             await update.message.reply_text("You don't have any bookings to cancel.")
@@ -531,6 +1200,9 @@ async def cancel_booking_start(update: Update, context: ContextTypes.DEFAULT_TYP
             else:
                 button_text = f"{booking['Date']} - {booking['Time']} - {booking['Flight Number']}"
             
+            if passenger_count(booking) > 1:
+                button_text += f" ({passenger_count(booking)} passengers)"
+            
             callback_data = f"{CANCEL_PREFIX}{index}"
             keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
         
@@ -550,6 +1222,46 @@ async def cancel_booking_start(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text(f"Error retrieving bookings: {e}")
         return ConversationHandler.END
 
+def release_booking(tables, user_id, date_str, time_str, flight_number):
+    """Storage mutation deleting a user's booking and freeing its seats; returns the booking."""
+    bookings_df = tables['bookings']
+    flights_df = tables['flights']
+    
+    booking_row = bookings_df[
+        (bookings_df['User ID'] == user_id) & 
+        (bookings_df['Date'] == date_str) & 
+        (bookings_df['Time'] == time_str) & 
+        (bookings_df['Flight Number'] == flight_number)
+    ]
+    
+    if booking_row.empty:
+        raise RejectedChange("This booking could not be found.")
+    
+    booking = booking_row.iloc[0]
+    seats = parse_seats(booking.get('Seats'))
+    
+    # Free the seats on a copy of the seat map first, so that nothing is changed if this fails
+    flight_row = flights_df[
+        (flights_df['Date'] == date_str) & 
+        (flights_df['Time'] == time_str) & 
+        (flights_df['Flight Number'] == flight_number)
+    ]
+    
+    if not flight_row.empty:
+        flight_index = flight_row.index[0]
+        seat_map = flight_seat_map(flights_df.loc[flight_index])
+        release_seats(seat_map, [seat for seat in seats if seat < flights_df.at[flight_index, 'Capacity']])
+    
+    tables['bookings'] = bookings_df.drop(booking_row.index[0])
+    record_seat_change(tables, flight_key(date_str, time_str, flight_number), seats, -1)
+    
+    # Update flight booking count
+    if not flight_row.empty:
+        flights_df.at[flight_index, 'Seat Map'] = seat_map_to_hex(seat_map)
+        flights_df.at[flight_index, 'Booked'] = occupied_seats(seat_map)
+    
+    return booking
+
 async def cancel_booking_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle booking cancellation."""
     query = update.callback_query
@@ -562,31 +1274,29 @@ async def cancel_booking_confirm(update: Update, context: ContextTypes.DEFAULT_T
     booking_index = int(query.data.replace(CANCEL_PREFIX, ""))
     
     try:
-        # Get booking details
+        # Get booking details; the callback carries the booking's row label
         bookings_df = context.user_data['bookings_df']
         user_id = update.effective_user.id
-        user_bookings = bookings_df[bookings_df['User ID'] == user_id]
-        booking = user_bookings.iloc[booking_index]
+        selected = bookings_df.loc[booking_index]
         
-        # Remove booking
-        booking_row_index = user_bookings.index[booking_index]
-        bookings_df = bookings_df.drop(booking_row_index)
-        bookings_df.to_excel(BOOKINGS_FILE, index=False)
-        
-        # Update flight booking count
-        flights_df = pd.read_excel(FLIGHTS_FILE)
-        flights_df['Date'] = pd.to_datetime(flights_df['Date']).dt.strftime("%Y-%m-%d")
+        if selected['User ID'] != user_id:
+            await query.edit_message_text("This booking could not be found.")
+            return ConversationHandler.END
         
-        flight_row = flights_df[
-            (flights_df['Date'] == booking['Date']) & 
-            (flights_df['Time'] == booking['Time']) & 
-            (flights_df['Flight Number'] == booking['Flight Number'])
-        ]
+        # Remove booking, looked up again by its identity since the file may have changed since
+        try:
+            booking = await commit_change(
+                release_booking, user_id, selected['Date'], selected['Time'], selected['Flight Number']
+            )
+        except RejectedChange as e:
+            await query.edit_message_text(str(e))
+            return ConversationHandler.END
         
-        if not flight_row.empty:
-            flight_index = flight_row.index[0]
-            flights_df.at[flight_index, 'Booked'] = max(0, flights_df.at[flight_index, 'Booked'] - 1)
-            flights_df.to_excel(FLIGHTS_FILE, index=False)
+        unschedule_reminder(user_id, booking['Date'], booking['Time'], booking['Flight Number'])
+        record_booking_stats(
+            flight_key(booking['Date'], booking['Time'], booking['Flight Number']),
+            pd.to_datetime(booking['Booking Time'], errors='coerce'), -passenger_count(booking)
+        )
         
         await query.edit_message_text(
             f"✅ Booking cancelled successfully:\n\n"
@@ -629,10 +1339,11 @@ async def show_available_flights(update: Update, context: ContextTypes.DEFAULT_T
         available_flights = available_flights.sort_values(by=['Date', 'Time'])
         
         # Group by date
+        fares = quote_fares(available_flights)
         message = "Available flights:\n\n"
         current_date = None
         
-        for _, flight in available_flights.iterrows():
+        for index, flight in available_flights.iterrows():
             flight_date = flight['Date'].strftime("%Y-%m-%d")
             
             if flight_date != current_date:
@@ -642,7 +1353,8 @@ async def show_available_flights(update: Update, context: ContextTypes.DEFAULT_T
             message += (
                 f"  • {flight['Time']} - Flight {flight['Flight Number']}\n"
                 f"    {flight['Departure']} to {flight['Destination']}\n"
-                f"    Available seats: {flight['Available']}\n\n"
+                f"    Available seats: {flight['Available']}\n"
+                f"    Fare: {CURRENCY}{fares[index]}\n\n"
             )
         
         message += "Use /book to book a flight."
@@ -664,13 +1376,41 @@ async def add_flight_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(
         "Please enter the flight details in the following format:\n\n"
-        "YYYY-MM-DD HH:MM FlightNumber Departure Destination Capacity\n\n"
-        "Example: 2025-04-01 08:30 FL123 New_York London 120\n\n"
+        "YYYY-MM-DD HH:MM FlightNumber Departure Destination Capacity [BaseFare]\n\n"
+        "Example: 2025-04-01 08:30 FL123 New_York London 120 450\n\n"
         "Type /cancel to cancel."
     )
     
     return ADMIN_ADDING_FLIGHT
 
+def insert_flight(tables, date_str, time_str, flight_number, departure, destination, capacity, base_fare):
+    """Storage mutation adding a new flight."""
+    flights_df = tables['flights']
+    
+    # Check if flight already exists
+    existing_flight = flights_df[
+        (flights_df['Date'] == date_str) & 
+        (flights_df['Time'] == time_str) & 
+        (flights_df['Flight Number'] == flight_number)
+    ]
+    
+    if not existing_flight.empty:
+        raise RejectedChange("This flight already exists in the system.")
+    
+    # Add new flight
+    new_flight = pd.DataFrame({
+        'Date': [date_str],
+        'Time': [time_str],
+        'Flight Number': [flight_number],
+        'Departure': [departure],
+        'Destination': [destination],
+        'Capacity': [capacity],
+        'Booked': [0],
+        'Seat Map': [seat_map_to_hex(empty_seat_map(capacity))],
+        'Base Fare': [base_fare]
+    })
+    tables['flights'] = pd.concat([flights_df, new_flight], ignore_index=True)
+
 async def add_flight_finish(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Process new flight details from admin."""
     if update.message.text == '/cancel':
@@ -690,6 +1430,7 @@ async def add_flight_finish(update: Update, context: ContextTypes.DEFAULT_TYPE):
         departure = parts[3].replace('_', ' ')
         destination = parts[4].replace('_', ' ')
         capacity = int(parts[5])
+        base_fare = int(parts[6]) if len(parts) > 6 else DEFAULT_BASE_FARE
         
         # Validate date
         try:
@@ -702,34 +1443,15 @@ async def add_flight_finish(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Invalid date format. Please use YYYY-MM-DD.")
             return ADMIN_ADDING_FLIGHT
         
-        # Read existing flights
-        flights_df = pd.read_excel(FLIGHTS_FILE)
-        
-        # Check if flight already exists
-        flights_df['Date'] = pd.to_datetime(flights_df['Date'])
-        existing_flight = flights_df[
-            (flights_df['Date'].dt.strftime("%Y-%m-%d") == date_str) & 
-            (flights_df['Time'] == time_str) & 
-            (flights_df['Flight Number'] == flight_number)
-        ]
-        
-        if not existing_flight.empty:
-            await update.message.reply_text("This flight already exists in the system.")
+        try:
+            await commit_change(
+                insert_flight, date_str, time_str, flight_number, departure, destination, capacity, base_fare
+            )
+        except RejectedChange as e:
+            await update.message.reply_text(str(e))
             return ADMIN_ADDING_FLIGHT
         
-        # Add new flight
-        new_flight = pd.DataFrame({
-            'Date': [date_str],
-            'Time': [time_str],
-            'Flight Number': [flight_number],
-            'Departure': [departure],
-            'Destination': [destination],
-            'Capacity': [capacity],
-            'Booked': [0]
-        })
-        
-        flights_df = pd.concat([flights_df, new_flight], ignore_index=True)
-        flights_df.to_excel(FLIGHTS_FILE, index=False)
+        record_flight_added(flight_key(date_str, time_str, flight_number), departure, destination, capacity)
         
         await update.message.reply_text(
             f"✅ Flight added successfully:\n\n"
@@ -737,7 +1459,8 @@ async def add_flight_finish(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Time: {time_str}\n"
             f"Flight: {flight_number}\n"
             f"Route: {departure} to {destination}\n"
-            f"Capacity: {capacity} seats"
+            f"Capacity: {capacity} seats\n"
+            f"Base fare: {CURRENCY}{base_fare}"
         )
         
         return ConversationHandler.END
@@ -747,6 +1470,39 @@ async def add_flight_finish(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"Error adding flight: {e}")
         return ADMIN_ADDING_FLIGHT
 
+def delete_flight(tables, date_str, time_str, flight_number):
+    """Storage mutation removing a flight that has no bookings."""
+    flights_df = tables['flights']
+    bookings_df = tables['bookings']
+    
+    # Find flight
+    flight_to_remove = flights_df[
+        (flights_df['Date'] == date_str) & 
+        (flights_df['Time'] == time_str) & 
+        (flights_df['Flight Number'] == flight_number)
+    ]
+    
+    if flight_to_remove.empty:
+        raise RejectedChange("Flight not found. Please check the details and try again.")
+    
+    flight_index = flight_to_remove.index[0]
+    
+    # Check the booking records rather than Booked, which may not have been repaired yet
+    has_bookings = (
+        (bookings_df['Date'] == date_str) &
+        (bookings_df['Time'] == time_str) &
+        (bookings_df['Flight Number'] == flight_number)
+    ).any()
+    if has_bookings:
+        raise RejectedChange(
+            "⚠️ Warning: This flight has existing bookings. "
+            "Please cancel these bookings first or use /force_remove_flight to remove it anyway."
+        )
+    
+    # Remove flight
+    tables['flights'] = flights_df.drop(flight_index)
+    record_flights_removed(tables, [flight_key(date_str, time_str, flight_number)])
+
 async def remove_flight(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Remove a flight (admin only)."""
     ensure_excel_files_exist()
@@ -768,34 +1524,13 @@ async def remove_flight(update: Update, context: ContextTypes.DEFAULT_TYPE):
         time_str = context.args[1]
         flight_number = context.args[2]
         
-        # Read flights data
-        flights_df = pd.read_excel(FLIGHTS_FILE)
-        flights_df['Date'] = pd.to_datetime(flights_df['Date'])
-        
-        # Find flight
-        flight_to_remove = flights_df[
-            (flights_df['Date'].dt.strftime("%Y-%m-%d") == date_str) & 
-            (flights_df['Time'] == time_str) & 
-            (flights_df['Flight Number'] == flight_number)
-        ]
-        
-        if flight_to_remove.empty:
-            await update.message.reply_text("Flight not found. Please check the details and try again.")
-            return
-        
-        flight_index = flight_to_remove.index[0]
-        
-        # Check if there are bookings
-        if flights_df.at[flight_index, 'Booked'] > 0:
-            await update.message.reply_text(
-                "⚠️ Warning: This flight has existing bookings. "
-                "Please cancel these bookings first or use /force_remove_flight to remove it anyway."
-            )
+        try:
+            await commit_change(delete_flight, date_str, time_str, flight_number)
+        except RejectedChange as e:
+            await update.message.reply_text(str(e))
             return
         
-        # Remove flight
-        flights_df = flights_df.drop(flight_index)
-        flights_df.to_excel(FLIGHTS_FILE, index=False)
+        record_flight_removed(flight_key(date_str, time_str, flight_number))
         
         await update.message.reply_text(
             f"✅ Flight removed successfully:\n\n"
@@ -808,6 +1543,1082 @@ async def remove_flight(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in remove_flight: {e}")
         await update.message.reply_text(f"Error removing flight: {e}")
 
+# Bulk flight cancellation
+def select_flights(flights_df, selection):
+    """Return a boolean mask of the flights matching a cancellation selection."""
+    mask = pd.Series(True, index=flights_df.index)
+
+    if selection.get('date_from'):
+        mask &= flights_df['Date'] >= selection['date_from']
+    if selection.get('date_to'):
+        mask &= flights_df['Date'] <= selection['date_to']
+    if selection.get('time'):
+        mask &= flights_df['Time'] == selection['time']
+    if selection.get('flight_number'):
+        mask &= flights_df['Flight Number'] == selection['flight_number']
+    if selection.get('departure'):
+        mask &= flights_df['Departure'].str.lower() == selection['departure'].lower()
+    if selection.get('destination'):
+        mask &= flights_df['Destination'].str.lower() == selection['destination'].lower()
+
+    return mask
+
+def cancel_flights_batch(tables, selection):
+    """Storage mutation removing the selected flights and deleting all of their bookings in one batch."""
+    flights_df = tables['flights']
+    bookings_df = tables['bookings']
+
+    removed_flights = flights_df[select_flights(flights_df, selection)]
+
+    if removed_flights.empty:
+        return removed_flights, bookings_df.iloc[0:0]
+
+    # Match bookings to the removed flights on (Date, Time, Flight Number) in a single pass
+    key_columns = ['Date', 'Time', 'Flight Number']
+    removed_keys = pd.MultiIndex.from_frame(removed_flights[key_columns].astype(str))
+    booking_keys = pd.MultiIndex.from_frame(bookings_df[key_columns].astype(str))
+    affected = booking_keys.isin(removed_keys)
+
+    cancelled_bookings = bookings_df[affected]
+    removed_flight_keys = table_keys(removed_flights)
+    tables['bookings'] = bookings_df[~affected]
+    tables['flights'] = flights_df.drop(removed_flights.index)
+    record_flights_removed(tables, removed_flight_keys)
+
+    return removed_flights, cancelled_bookings
+
+async def cancellation_job(context: ContextTypes.DEFAULT_TYPE):
+    """Run a bulk cancellation in the background and queue notifications for affected users."""
+    job = context.job
+    description = job.data['description']
+
+    try:
+        removed_flights, cancelled_bookings = await commit_change(cancel_flights_batch, job.data['selection'])
+    except Exception as e:
+        logger.error(f"Error in cancellation_job: {e}")
+        await context.bot.send_message(chat_id=job.chat_id, text=f"Error cancelling {description}: {e}")
+        return
+
+    if removed_flights.empty:
+        await context.bot.send_message(chat_id=job.chat_id, text=f"Nothing to cancel: no flights match {description}.")
+        return
+
+    for date_str, time_str, flight_number in zip(
+        removed_flights['Date'], removed_flights['Time'], removed_flights['Flight Number']
+    ):
+        record_flight_removed(flight_key(date_str, time_str, flight_number))
+
+    # Send each passenger a single message listing all of their cancelled bookings
+    for user_id, user_bookings in cancelled_bookings.groupby('User ID'):
+        message = "⚠️ The following bookings were cancelled because the flight was removed:\n\n"
+        for _, booking in user_bookings.iterrows():
+            unschedule_reminder(user_id, booking['Date'], booking['Time'], booking['Flight Number'])
+            # The flight's seats left the aggregates with the flight; only the booking hour remains
+            record_booking_stats(
+                flight_key(booking['Date'], booking['Time'], booking['Flight Number']),
+                pd.to_datetime(booking['Booking Time'], errors='coerce'), -passenger_count(booking)
+            )
+            message += f"• {booking['Date']} {booking['Time']} - Flight {booking['Flight Number']}"
+            if passenger_count(booking) > 1:
+                message += f" ({passenger_count(booking)} passengers)"
+            message += "\n"
+        queue_notification(int(user_id), message)
+
+    await context.bot.send_message(
+        chat_id=job.chat_id,
+        text=(
+            f"✅ Cancellation of {description} finished:\n\n"
+            f"Flights removed: {len(removed_flights)}\n"
+            f"Bookings cancelled: {len(cancelled_bookings)}\n"
+            f"Passengers notified: {cancelled_bookings['User ID'].nunique()}"
+        )
+    )
+
+def schedule_cancellation(context: ContextTypes.DEFAULT_TYPE, chat_id, selection, description):
+    """Queue a bulk cancellation job on the application job queue."""
+    context.job_queue.run_once(
+        cancellation_job,
+        0,
+        data={'selection': selection, 'description': description},
+        chat_id=chat_id,
+        name=f"cancellation:{description}"
+    )
+
+def parse_date_range(args):
+    """Parse optional [YYYY-MM-DD [YYYY-MM-DD]] arguments into a (from, to) pair."""
+    dates = [datetime.strptime(arg, "%Y-%m-%d").strftime("%Y-%m-%d") for arg in args[:2]]
+    if not dates:
+        return None, None
+    if len(dates) == 1:
+        return dates[0], dates[0]
+    return dates[0], dates[1]
+
+async def force_remove_flight(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Remove a flight together with all of its bookings (admin only)."""
+    ensure_excel_files_exist()
+
+    # Check if user is admin
+    if update.effective_user.id not in ADMIN_USERS:
+        await update.message.reply_text("This command is only available to administrators.")
+        return
+
+    if not context.args or len(context.args) < 3:
+        await update.message.reply_text(
+            "Please provide flight details: /force_remove_flight YYYY-MM-DD HH:MM FL123\n"
+            "Example: /force_remove_flight 2025-04-01 08:30 FL123"
+        )
+        return
+
+    try:
+        date_str, _ = parse_date_range(context.args[:1])
+    except ValueError:
+        await update.message.reply_text("Invalid date format. Please use YYYY-MM-DD.")
+        return
+
+    time_str = context.args[1]
+    flight_number = context.args[2]
+    selection = {
+        'date_from': date_str,
+        'date_to': date_str,
+        'time': time_str,
+        'flight_number': flight_number
+    }
+    description = f"flight {flight_number} on {date_str} at {time_str}"
+
+    schedule_cancellation(context, update.effective_chat.id, selection, description)
+    await update.message.reply_text(
+        f"⏳ Removing {description} and its bookings in the background. "
+        f"You will receive a summary when it is done."
+    )
+
+async def cancel_route(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancel all flights on a route, optionally within a date range (admin only)."""
+    ensure_excel_files_exist()
+
+    # Check if user is admin
+    if update.effective_user.id not in ADMIN_USERS:
+        await update.message.reply_text("This command is only available to administrators.")
+        return
+
+    if not context.args or len(context.args) < 2:
+        await update.message.reply_text(
+            "Please provide the route: /cancel_route Departure Destination [YYYY-MM-DD [YYYY-MM-DD]]\n"
+            "Example: /cancel_route New_York London 2025-04-01 2025-04-07"
+        )
+        return
+
+    departure = context.args[0].replace('_', ' ')
+    destination = context.args[1].replace('_', ' ')
+
+    try:
+        date_from, date_to = parse_date_range(context.args[2:])
+    except ValueError:
+        await update.message.reply_text("Invalid date format. Please use YYYY-MM-DD.")
+        return
+
+    selection = {
+        'date_from': date_from,
+        'date_to': date_to,
+        'departure': departure,
+        'destination': destination
+    }
+    description = f"route {departure} to {destination}"
+    if date_from:
+        description += f" from {date_from} to {date_to}"
+
+    schedule_cancellation(context, update.effective_chat.id, selection, description)
+    await update.message.reply_text(
+        f"⏳ Cancelling all flights on {description} in the background. "
+        f"You will receive a summary when it is done."
+    )
+
+async def cancel_dates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancel all flights within a date range (admin only)."""
+    ensure_excel_files_exist()
+
+    # Check if user is admin
+    if update.effective_user.id not in ADMIN_USERS:
+        await update.message.reply_text("This command is only available to administrators.")
+        return
+
+    if not context.args:
+        await update.message.reply_text(
+            "Please provide the dates: /cancel_dates YYYY-MM-DD [YYYY-MM-DD]\n"
+            "Example: /cancel_dates 2025-04-01 2025-04-03"
+        )
+        return
+
+    try:
+        date_from, date_to = parse_date_range(context.args)
+    except ValueError:
+        await update.message.reply_text("Invalid date format. Please use YYYY-MM-DD.")
+        return
+
+    selection = {'date_from': date_from, 'date_to': date_to}
+    description = f"all flights from {date_from} to {date_to}"
+
+    schedule_cancellation(context, update.effective_chat.id, selection, description)
+    await update.message.reply_text(
+        f"⏳ Cancelling {description} in the background. "
+        f"You will receive a summary when it is done."
+    )
+
+# Outbound notifications
+def queue_notification(chat_id, text):
+    """Queue a message for the notification workers."""
+    notification_queue.put_nowait((chat_id, text))
+
+async def wait_for_send_slot():
+    """Reserve the next send slot so that all workers together stay under the rate limit."""
+    global next_send_slot
+    loop = asyncio.get_running_loop()
+
+    while True:
+        slot = max(loop.time(), next_send_slot)
+        next_send_slot = slot + 1 / NOTIFICATIONS_PER_SECOND
+
+        delay = slot - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        # A slot reserved before another worker hit flood control is given up for one after the pause
+        if loop.time() >= send_paused_until:
+            return
+
+async def send_notification(bot, chat_id, text):
+    """Send a single notification, retrying transient failures with exponential backoff."""
+    global next_send_slot, send_paused_until
+
+    for attempt in range(NOTIFICATION_MAX_RETRIES + 1):
+        await wait_for_send_slot()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+            return
+        except RetryAfter as e:
+            # Flood control hit anyway: all workers back off for as long as Telegram asks
+            retry_after = e.retry_after
+            delay = retry_after.total_seconds() if isinstance(retry_after, timedelta) else retry_after
+            send_paused_until = max(send_paused_until, asyncio.get_running_loop().time() + delay)
+            next_send_slot = max(next_send_slot, send_paused_until)
+        except Forbidden:
+            logger.info(f"User {chat_id} blocked the bot, dropping notification")
+            return
+        except NetworkError as e:
+            delay = NOTIFICATION_BACKOFF * 2 ** attempt
+            logger.warning(f"Error sending notification to {chat_id}: {e}")
+        except TelegramError as e:
+            logger.error(f"Error sending notification to {chat_id}: {e}")
+            return
+
+        if attempt < NOTIFICATION_MAX_RETRIES:
+            logger.warning(f"Retrying notification to {chat_id} in {delay}s")
+            await asyncio.sleep(delay)
+
+    logger.error(f"Giving up on notification to {chat_id} after {NOTIFICATION_MAX_RETRIES + 1} attempts")
+
+async def notification_worker(application: Application):
+    """Drain the notification queue; several workers bound the number of in-flight sends."""
+    while True:
+        chat_id, text = await notification_queue.get()
+        try:
+            await send_notification(application.bot, chat_id, text)
+        except Exception as e:
+            logger.error(f"Error in notification_worker: {e}")
+        finally:
+            notification_queue.task_done()
+
+# Departure reminders
+def departure_time(date_str, time_str):
+    """Return the departure datetime of a flight."""
+    return datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
+
+def reminder_key(user_id, date_str, time_str, flight_number):
+    """Return the key identifying a booking's reminder."""
+    return (int(user_id), str(date_str), str(time_str), str(flight_number))
+
+def schedule_reminder(user_id, date_str, time_str, flight_number):
+    """Schedule a departure reminder for a booking."""
+    try:
+        departure = departure_time(date_str, time_str)
+    except ValueError:
+        logger.warning(f"Cannot schedule reminder for flight {flight_number} on {date_str} {time_str}")
+        return
+
+    now = datetime.now()
+    if departure <= now:
+        return
+
+    key = reminder_key(user_id, date_str, time_str, flight_number)
+    send_at = max(departure - timedelta(hours=REMINDER_HOURS), now)
+    reminder_index[key] = send_at
+    heapq.heappush(reminder_heap, (send_at, key))
+
+def unschedule_reminder(user_id, date_str, time_str, flight_number):
+    """Cancel a booking's reminder.
+
+    The heap entry itself is left in place and skipped when it is popped, which keeps
+    cancellation O(1) instead of searching the heap.
+    """
+    reminder_index.pop(reminder_key(user_id, date_str, time_str, flight_number), None)
+
+    # Compact the heap once cancelled entries dominate it
+    if len(reminder_heap) > 2 * len(reminder_index) + 1000:
+        reminder_heap[:] = [(send_at, key) for key, send_at in reminder_index.items()]
+        heapq.heapify(reminder_heap)
+
+def build_reminder_heap():
+    """Build the reminder heap from all existing bookings."""
+    reminder_heap.clear()
+    reminder_index.clear()
+
+    bookings_df = pd.read_excel(BOOKINGS_FILE)
+    now = datetime.now()
+
+    # Bookings whose reminder was already sent before a restart are not reminded again
+    if 'Reminded' in bookings_df:
+        bookings_df = bookings_df[~bookings_df['Reminded'].eq(True)]
+
+    for user_id, date_str, time_str, flight_number in zip(
+        bookings_df['User ID'], bookings_df['Date'], bookings_df['Time'], bookings_df['Flight Number']
+    ):
+        try:
+            departure = departure_time(date_str, time_str)
+        except ValueError:
+            continue
+        if departure > now:
+            key = reminder_key(user_id, date_str, time_str, flight_number)
+            reminder_index[key] = max(departure - timedelta(hours=REMINDER_HOURS), now)
+
+    # Heapify once instead of pushing every booking
+    reminder_heap.extend((send_at, key) for key, send_at in reminder_index.items())
+    heapq.heapify(reminder_heap)
+    logger.info(f"Scheduled {len(reminder_index)} departure reminders")
+
+def mark_reminded(tables, keys):
+    """Storage mutation recording that the reminders of the given bookings have been sent."""
+    bookings_df = tables['bookings']
+    reminded = pd.Series([
+        reminder_key(*booking) in keys
+        for booking in zip(bookings_df['User ID'], bookings_df['Date'], bookings_df['Time'], bookings_df['Flight Number'])
+    ], index=bookings_df.index, dtype=bool)
+    # Files written before reminders were recorded have no column or empty cells, both meaning not sent
+    if 'Reminded' in bookings_df:
+        reminded |= bookings_df['Reminded'].eq(True)
+    bookings_df['Reminded'] = reminded
+
+async def reminder_job(context: ContextTypes.DEFAULT_TYPE):
+    """Queue the reminders that are due; only due entries are touched on each tick."""
+    now = datetime.now()
+    sent = set()
+
+    while reminder_heap and reminder_heap[0][0] <= now:
+        send_at, key = heapq.heappop(reminder_heap)
+
+        # Skip entries whose booking was cancelled or rescheduled
+        if reminder_index.get(key) != send_at:
+            continue
+        del reminder_index[key]
+
+        user_id, date_str, time_str, flight_number = key
+        queue_notification(
+            user_id,
+            f"⏰ Reminder: your flight {flight_number} departs on {date_str} at {time_str}.\n\n"
+            f"You can view your bookings with /my_bookings"
+        )
+        sent.add(key)
+
+    if not sent:
+        return
+
+    # Mark the bookings so that a restart does not send their reminders again
+    try:
+        await commit_change(mark_reminded, sent)
+    except Exception as e:
+        logger.error(f"Error marking {len(sent)} reminders as sent: {e}")
+
+# Archival of departed flights
+def archive_path(table, month):
+    """Return the path of a monthly archive partition, e.g. archive/bookings-2025-03.csv.gz."""
+    return os.path.join(ARCHIVE_DIR, f"{table}-{month}.csv.gz")
+
+def append_to_archive(table, month, df):
+    """Append rows to a monthly archive partition."""
+    path = archive_path(table, month)
+    if os.path.exists(path):
+        # drop_duplicates makes re-running an interrupted archival harmless
+        df = pd.concat([pd.read_csv(path), df], ignore_index=True).drop_duplicates()
+
+    temp_path = f"{path}.tmp"
+    df.to_csv(temp_path, index=False, compression='gzip')
+    os.replace(temp_path, path)
+
+def load_archive(table, month=None):
+    """Load one monthly archive partition, or all of them, into a single DataFrame."""
+    pattern = archive_path(table, month or "*")
+    partitions = [pd.read_csv(path) for path in sorted(glob.glob(pattern))]
+    if not partitions:
+        return pd.DataFrame()
+    return pd.concat(partitions, ignore_index=True)
+
+def archive_departed_flights(tables):
+    """Storage mutation moving flights that departed before today, and their bookings, into monthly archive partitions."""
+    today = datetime.now().strftime("%Y-%m-%d")
+
+    flights_df = tables['flights']
+    bookings_df = tables['bookings']
+    flight_dates = pd.to_datetime(flights_df['Date'], errors='coerce').dt.strftime("%Y-%m-%d")
+    booking_dates = pd.to_datetime(bookings_df['Date'], errors='coerce').dt.strftime("%Y-%m-%d")
+
+    # Rows with an unreadable date stay in the hot files instead of failing every archival
+    for table, df, dates in (('flights', flights_df, flight_dates), ('bookings', bookings_df, booking_dates)):
+        unreadable = df[dates.isna()]
+        if not unreadable.empty:
+            rows = ', '.join(
+                f"{date!r} {time} {flight_number}"
+                for date, time, flight_number in zip(unreadable['Date'], unreadable['Time'], unreadable['Flight Number'])
+            )
+            logger.warning(f"Not archiving {len(unreadable)} {table} with unreadable dates: {rows}")
+
+    # Unreadable dates count as today, which is never departed
+    departed_flights = flight_dates.fillna(today) < today
+    departed_bookings = booking_dates.fillna(today) < today
+
+    if not departed_flights.any() and not departed_bookings.any():
+        return 0, 0
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+    archived_flights = flights_df[departed_flights]
+    archived_bookings = bookings_df[departed_bookings]
+    archived_keys = set(table_keys(archived_flights)) | set(table_keys(archived_bookings))
+
+    # The archive partitions are written before the hot files so that nothing is lost on a crash
+    for month, month_flights in archived_flights.groupby(flight_dates[departed_flights].str[:7]):
+        append_to_archive('flights', month, month_flights)
+
+    for month, month_bookings in archived_bookings.groupby(booking_dates[departed_bookings].str[:7]):
+        append_to_archive('bookings', month, month_bookings)
+
+    tables['bookings'] = bookings_df[~departed_bookings]
+    tables['flights'] = flights_df[~departed_flights]
+    record_flights_removed(tables, archived_keys)
+
+    return len(archived_flights), len(archived_bookings)
+
+async def archive_job(context: ContextTypes.DEFAULT_TYPE):
+    """Nightly job moving departed flights and their bookings to the archive."""
+    try:
+        flights, bookings = await commit_change(archive_departed_flights)
+        # Every quote is a day closer to departure now, and archived flights need none
+        fare_cache.clear()
+        logger.info(f"Archived {flights} departed flights and {bookings} bookings")
+    except Exception as e:
+        logger.error(f"Error in archive_job: {e}")
+
+# Admin analytics
+def flight_key(date_str, time_str, flight_number):
+    """Return the key identifying a single flight."""
+    return (str(date_str), str(time_str), str(flight_number))
+
+def build_report_stats():
+    """Build the report aggregates from the Excel files; afterwards they are updated incrementally."""
+    flight_stats.clear()
+    route_stats.clear()
+    hourly_bookings.clear()
+
+    # Archived flights and bookings are read once here so that the report covers the full history
+    flights_df = pd.concat([load_archive('flights'), pd.read_excel(FLIGHTS_FILE)], ignore_index=True)
+    flights_df['Date'] = pd.to_datetime(flights_df['Date']).dt.strftime("%Y-%m-%d")
+    for date_str, time_str, flight_number, departure, destination, capacity, booked in zip(
+        flights_df['Date'], flights_df['Time'], flights_df['Flight Number'],
+        flights_df['Departure'], flights_df['Destination'], flights_df['Capacity'], flights_df['Booked']
+    ):
+        record_flight_added(flight_key(date_str, time_str, flight_number), departure, destination, capacity)
+        record_booking_stats(flight_key(date_str, time_str, flight_number), None, int(booked))
+
+    bookings_df = pd.concat([load_archive('bookings'), pd.read_excel(BOOKINGS_FILE)], ignore_index=True)
+    booking_hours = pd.to_datetime(bookings_df['Booking Time']).dt.strftime("%Y-%m-%d %H:00")
+    hourly_bookings.update(booking_hours.value_counts().to_dict())
+
+def record_flight_added(key, departure, destination, capacity):
+    """Add a flight's capacity to the report aggregates."""
+    route = (departure, destination)
+    flight_stats[key] = {'route': route, 'capacity': int(capacity), 'booked': 0}
+    stats = route_stats.setdefault(route, {'capacity': 0, 'booked': 0})
+    stats['capacity'] += int(capacity)
+
+def record_flight_removed(key):
+    """Remove a flight and its booked seats from the report aggregates."""
+    stats = flight_stats.pop(key, None)
+    if stats is None:
+        return
+    route = route_stats[stats['route']]
+    route['capacity'] -= stats['capacity']
+    route['booked'] -= stats['booked']
+    if route['capacity'] <= 0:
+        del route_stats[stats['route']]
+
+def record_booking_stats(key, booking_time, seats=1):
+    """Count booked (or, with negative seats, cancelled) seats on a flight.
+
+    A cancellation is taken off the hour its booking was made in, so the counts match what
+    build_report_stats rebuilds from the bookings still on file.
+    """
+    stats = flight_stats.get(key)
+    if stats is not None:
+        stats['booked'] += seats
+        route_stats[stats['route']]['booked'] += seats
+
+    if booking_time is None or pd.isna(booking_time) or seats == 0:
+        return
+    hour = booking_time.strftime("%Y-%m-%d %H:00")
+    hourly_bookings[hour] += 1 if seats > 0 else -1
+    if hourly_bookings[hour] <= 0:
+        del hourly_bookings[hour]
+
+def load_factor(booked, capacity):
+    """Return booked/capacity as a percentage."""
+    return 100 * booked / capacity if capacity else 0.0
+
+def format_report():
+    """Render the admin report from the incrementally maintained aggregates."""
+    total_capacity = sum(stats['capacity'] for stats in route_stats.values())
+    total_booked = sum(stats['booked'] for stats in route_stats.values())
+
+    message = (
+        f"📊 Booking report\n\n"
+        f"Flights: {len(flight_stats)}\n"
+        f"Seats booked: {total_booked}/{total_capacity} "
+        f"({load_factor(total_booked, total_capacity):.1f}% load factor)\n\n"
+    )
+
+    # Booking velocity from the hourly buckets of the last REPORT_HOURS hours
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    hours = [(now - timedelta(hours=offset)).strftime("%Y-%m-%d %H:00") for offset in range(REPORT_HOURS)]
+    recent = [hourly_bookings.get(hour, 0) for hour in hours]
+    message += (
+        f"Bookings in the last {REPORT_HOURS} hours: {sum(recent)} "
+        f"({sum(recent) / REPORT_HOURS:.1f} per hour)\n"
+    )
+    for hour, count in list(zip(hours, recent))[:REPORT_RECENT_HOURS]:
+        message += f"  {hour}  {'▇' * min(count, 20)} {count}\n"
+
+    message += "\nTop routes:\n"
+    top_routes = heapq.nlargest(REPORT_TOP_N, route_stats.items(), key=lambda item: item[1]['booked'])
+    for rank, ((departure, destination), stats) in enumerate(top_routes, 1):
+        message += (
+            f"{rank}. {departure} to {destination}: {stats['booked']}/{stats['capacity']} seats "
+            f"({load_factor(stats['booked'], stats['capacity']):.1f}%)\n"
+        )
+
+    message += "\nFullest flights:\n"
+    fullest = heapq.nlargest(
+        REPORT_TOP_N, flight_stats.items(),
+        key=lambda item: load_factor(item[1]['booked'], item[1]['capacity'])
+    )
+    for (date_str, time_str, flight_number), stats in fullest:
+        message += (
+            f"• {date_str} {time_str} {flight_number}: {stats['booked']}/{stats['capacity']} "
+            f"({load_factor(stats['booked'], stats['capacity']):.1f}%)\n"
+        )
+
+    return message
+
+def format_route_table():
+    """Render the per-route load factor table as CSV."""
+    lines = ["Departure,Destination,Capacity,Booked,Load Factor"]
+    for (departure, destination), stats in sorted(route_stats.items()):
+        lines.append(
+            f"{departure},{destination},{stats['capacity']},{stats['booked']},"
+            f"{load_factor(stats['booked'], stats['capacity']):.1f}%"
+        )
+    return "\n".join(lines) + "\n"
+
+async def report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show load factor and booking velocity statistics (admin only)."""
+    # Check if user is admin
+    if update.effective_user.id not in ADMIN_USERS:
+        await update.message.reply_text("This command is only available to administrators.")
+        return
+
+    try:
+        await update.message.reply_text(format_report())
+        await update.message.reply_document(
+            document=io.BytesIO(format_route_table().encode()),
+            filename="routes_report.csv"
+        )
+    except Exception as e:
+        logger.error(f"Error in report: {e}")
+        await update.message.reply_text(f"Error generating report: {e}")
+
+# Booking integrity
+# flights.xlsx and bookings.xlsx are written one after the other, so a crash between the two writes, a
+# failed write or a manual edit can leave a flight's Booked count and seat map out of step with its
+# bookings. The ledger holds what every flight should look like according to its booking records: it is
+# built in one pass over bookings.xlsx by the startup audit and then updated from the seat changes
+# each committed mutation records. Flights changed since the last check are compared against it in the
+# background, and flights that disagree are rebuilt from their bookings.
+@functools.lru_cache(maxsize=None)
+def seat_hash(seat):
+    """Return a 63-bit hash of a seat index."""
+    digest = hashlib.blake2b(seat.to_bytes(4, 'little'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') >> 1
+
+def seat_checksum(seats):
+    """XOR the hashes of a set of seats; adding and removing the same seats cancel out."""
+    checksum = 0
+    for seat in seats:
+        checksum ^= seat_hash(seat)
+    return checksum
+
+def seat_map_bytes(value):
+    """Decode a "Seat Map" cell into bytes, treating a missing map as empty; None if unreadable."""
+    if isinstance(value, str) and value.startswith("0x"):
+        try:
+            return bytes.fromhex(value[2:])
+        except ValueError:
+            return None
+    if not isinstance(value, str) and pd.isna(value) or value == "":
+        return b""
+    return None
+
+@functools.lru_cache(maxsize=None)
+def byte_checksum_table(width):
+    """Return the seat checksum of every byte value at every position of a seat map, shape (width, 256)."""
+    table = np.zeros((width, 256), dtype=np.int64)
+    for position in range(width):
+        for value in range(1, 256):
+            # Each value adds its lowest seat to the value without that seat
+            lowest = (value & -value).bit_length() - 1
+            table[position, value] = table[position, value & (value - 1)] ^ seat_hash(position * 8 + lowest)
+    return table
+
+def table_keys(df):
+    """Return the flight key of every row of a flights or bookings table."""
+    # Same keys as flight_key, with the columns converted to strings in bulk
+    dates = pd.to_datetime(df['Date'], errors='coerce').dt.strftime("%Y-%m-%d").fillna("NaT")
+    return list(zip(dates.tolist(), df['Time'].astype(str).tolist(), df['Flight Number'].astype(str).tolist()))
+
+def flights_with_keys(flights_df, keys):
+    """Return the rows of the flights whose key is in `keys`."""
+    return flights_df[[key in keys for key in table_keys(flights_df)]]
+
+def record_seat_change(tables, key, seats, sign):
+    """Record in a batch that a flight's bookings gained (sign 1) or lost (sign -1) seats."""
+    tables.setdefault('ledger_changes', []).append((key, sign * len(seats), seat_checksum(seats)))
+
+def record_flights_removed(tables, keys):
+    """Record in a batch that flights were removed together with their bookings."""
+    tables.setdefault('ledger_changes', []).extend((key, None, None) for key in keys)
+
+def update_ledger(tables):
+    """Apply the seat changes of a written batch to the ledger and mark their flights for checking."""
+    with ledger_lock:
+        if 'ledger_reset' in tables:
+            # A full audit has just checked every flight
+            booking_ledger.clear()
+            booking_ledger.update(tables['ledger_reset'])
+            dirty_flights.clear()
+
+        for key, seats, checksum in tables.get('ledger_changes', []):
+            if seats is None:
+                booking_ledger.pop(key, None)
+                dirty_flights.discard(key)
+                continue
+            booked, total = booking_ledger.get(key, (0, 0))
+            booking_ledger[key] = (booked + seats, total ^ checksum)
+            dirty_flights.add(key)
+
+def build_ledger(bookings_df):
+    """Compute the (booked seats, seat checksum) of every flight from its booking records.
+
+    Returns the ledger and the keys of the flights with bookings holding unreadable seat labels,
+    which are left out of the ledger.
+    """
+    ledger = {}
+    unreadable = set()
+
+    # One pass over the bookings, folding each into its flight's entry
+    for key, value in zip(table_keys(bookings_df), bookings_df['Seats']):
+        seats, invalid = split_seats(value)
+        if invalid:
+            unreadable.add(key)
+        booked, checksum = ledger.get(key, (0, 0))
+        ledger[key] = (booked + len(seats), checksum ^ seat_checksum(seats))
+
+    return ledger, unreadable
+
+def find_drift(flights_df, ledger):
+    """Return the keys of the flights whose Booked count or seat map disagrees with the ledger."""
+    keys = table_keys(flights_df)
+    expected = [ledger.get(key, (0, 0)) for key in keys]
+    expected_booked = np.array([booked for booked, _ in expected], dtype=np.int64)
+    expected_checksum = np.array([checksum for _, checksum in expected], dtype=np.int64)
+
+    # Lay the seat maps out as a zero-padded byte matrix with one row per flight
+    seat_maps = [seat_map_bytes(value) for value in flights_df['Seat Map']]
+    width = max((len(seat_map) for seat_map in seat_maps if seat_map), default=0)
+    matrix = np.zeros((len(seat_maps), width), dtype=np.uint8)
+    for row, seat_map in enumerate(seat_maps):
+        if seat_map:
+            matrix[row, :len(seat_map)] = np.frombuffer(seat_map, dtype=np.uint8)
+
+    # Seat counts and checksums of all maps at once; an unreadable map counts as -1 seats
+    map_booked = np.unpackbits(matrix, axis=1).sum(axis=1, dtype=np.int64)
+    map_booked[[seat_map is None for seat_map in seat_maps]] = -1
+    map_checksum = np.bitwise_xor.reduce(byte_checksum_table(width)[np.arange(width), matrix], axis=1)
+    booked = pd.to_numeric(flights_df['Booked'], errors='coerce').fillna(-1).to_numpy()
+
+    agrees = (booked == expected_booked) & (map_booked == expected_booked) & (map_checksum == expected_checksum)
+    return [key for key, agree in zip(keys, agrees) if not agree]
+
+def repair_flights(tables, keys):
+    """Storage mutation rebuilding the seat maps and Booked counts of flights from their booking records.
+
+    Returns (key, old Booked, new Booked) for every flight that had to be changed, and the keys of the
+    flights whose bookings hold the same seat twice, seats beyond capacity or unreadable seat labels.
+    """
+    flights_df = tables['flights']
+    bookings_df = tables['bookings']
+    keys = set(keys)
+
+    booked_seats = {}
+    unreadable = set()
+    for key, value in zip(table_keys(bookings_df), bookings_df['Seats']):
+        if key in keys:
+            seats, invalid = split_seats(value)
+            booked_seats.setdefault(key, []).extend(seats)
+            if invalid:
+                unreadable.add(key)
+
+    # Unreadable Booked cells count as -1 so that they are always rewritten
+    booked_counts = pd.to_numeric(flights_df['Booked'], errors='coerce').fillna(-1).astype(int)
+
+    repairs = []
+    conflicts = []
+    for key, index in zip(table_keys(flights_df), flights_df.index):
+        if key not in keys:
+            continue
+        capacity = int(flights_df.at[index, 'Capacity'])
+        seat_map = empty_seat_map(capacity)
+        occupy_seats(seat_map, [seat for seat in booked_seats.get(key, []) if seat < capacity])
+        if key in unreadable or occupied_seats(seat_map) != len(booked_seats.get(key, [])):
+            conflicts.append(key)
+
+        old_booked = int(booked_counts[index])
+        if flights_df.at[index, 'Seat Map'] != seat_map_to_hex(seat_map) or old_booked != occupied_seats(seat_map):
+            flights_df.at[index, 'Seat Map'] = seat_map_to_hex(seat_map)
+            flights_df.at[index, 'Booked'] = occupied_seats(seat_map)
+            repairs.append((key, old_booked, occupied_seats(seat_map)))
+
+    return repairs, conflicts
+
+def audit_tables(tables):
+    """Storage mutation rebuilding the ledger from all booking records and repairing every flight that disagrees.
+
+    Returns (flights checked, repairs, conflicting flights, orphan bookings).
+    """
+    ledger, unreadable = build_ledger(tables['bookings'])
+    # The rebuilt ledger already includes the changes made earlier in this batch
+    tables['ledger_reset'] = ledger
+    tables['ledger_changes'] = []
+
+    repairs, conflicts = repair_flights(tables, find_drift(tables['flights'], ledger))
+    flight_keys = set(table_keys(tables['flights']))
+    orphans = sum(key not in flight_keys for key in table_keys(tables['bookings']))
+
+    # Bookings with unreadable seats are conflicts even when the readable seats match the flight
+    conflicts += [key for key in unreadable if key in flight_keys and key not in conflicts]
+
+    return len(flight_keys), repairs, conflicts, orphans
+
+def record_repairs(repairs, conflicts):
+    """Log repairs and conflicts for /integrity and correct the report aggregates."""
+    for key in conflicts:
+        logger.warning(f"Flight {' '.join(key)} has seats booked twice, beyond its capacity or unreadable")
+        if key not in integrity_status['conflicts']:
+            integrity_status['conflicts'].append(key)
+
+    for key, old_booked, new_booked in repairs:
+        logger.warning(f"Repaired flight {' '.join(key)}: Booked {old_booked} -> {new_booked}")
+        integrity_repairs.append((datetime.now(), key, old_booked, new_booked))
+        stats = flight_stats.get(key)
+        if stats is not None:
+            record_booking_stats(key, None, new_booked - stats['booked'])
+
+async def run_integrity_audit():
+    """Run a full audit through the committer and record its results."""
+    checked, repairs, conflicts, orphans = await commit_change(audit_tables)
+    integrity_status.update(last_audit=datetime.now(), flights_checked=checked, conflicts=[], orphan_bookings=orphans)
+    record_repairs(repairs, conflicts)
+    logger.info(f"Integrity audit checked {checked} flights and repaired {len(repairs)}")
+
+async def integrity_job(context: ContextTypes.DEFAULT_TYPE):
+    """Check the flights changed since the last run against the ledger and repair any drift."""
+    global full_audit_pending
+
+    try:
+        if full_audit_pending:
+            full_audit_pending = False
+            await run_integrity_audit()
+            return
+
+        with ledger_lock:
+            expected = {key: booking_ledger.get(key, (0, 0)) for key in dirty_flights}
+            dirty_flights.clear()
+        if not expected:
+            return
+
+        flights_df = await asyncio.to_thread(pd.read_excel, FLIGHTS_FILE)
+        drifted = find_drift(flights_with_keys(flights_df, expected), expected)
+        if drifted:
+            # The repair re-checks against the booking records, so a change committed since the
+            # ledger was read does not cause a wrong repair
+            record_repairs(*await commit_change(repair_flights, drifted))
+        integrity_status['last_check'] = datetime.now()
+    except Exception as e:
+        logger.error(f"Error in integrity_job: {e}")
+        full_audit_pending = True
+
+def format_integrity_report():
+    """Render the integrity status for /integrity."""
+    last_audit = integrity_status['last_audit']
+    last_check = integrity_status['last_check']
+    with ledger_lock:
+        waiting = len(dirty_flights)
+
+    message = (
+        f"🩺 Booking integrity\n\n"
+        f"Last full audit: {last_audit.strftime('%Y-%m-%d %H:%M:%S') if last_audit else 'not yet run'} "
+        f"({integrity_status['flights_checked']} flights)\n"
+        f"Last incremental check: {last_check.strftime('%Y-%m-%d %H:%M:%S') if last_check else 'none'}\n"
+        f"Flights waiting for a check: {waiting}\n"
+        f"Bookings for missing flights: {integrity_status['orphan_bookings']}\n"
+    )
+
+    if integrity_status['conflicts']:
+        message += "\n⚠️ Flights with seats booked twice, beyond capacity or unreadable:\n"
+        for date_str, time_str, flight_number in integrity_status['conflicts']:
+            message += f"• {date_str} {time_str} {flight_number}\n"
+
+    if integrity_repairs:
+        message += "\nRecent repairs:\n"
+        for repaired_at, (date_str, time_str, flight_number), old_booked, new_booked in reversed(integrity_repairs):
+            message += (
+                f"• {repaired_at.strftime('%Y-%m-%d %H:%M')}: {date_str} {time_str} {flight_number}, "
+                f"Booked {old_booked} → {new_booked}\n"
+            )
+    else:
+        message += "\nNo repairs so far.\n"
+
+    return message
+
+async def integrity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the integrity audit results and recent repairs; /integrity audit runs a full audit (admin only)."""
+    # Check if user is admin
+    if update.effective_user.id not in ADMIN_USERS:
+        await update.message.reply_text("This command is only available to administrators.")
+        return
+
+    try:
+        if context.args and context.args[0].lower() == "audit":
+            await run_integrity_audit()
+        await update.message.reply_text(format_integrity_report())
+    except Exception as e:
+        logger.error(f"Error in integrity: {e}")
+        await update.message.reply_text(f"Error checking integrity: {e}")
+
+# On-demand profiling
+# /profile samples the stacks of all threads from a background thread for a time window. A coroutine
+# suspended on an await (a Telegram API call, a commit) has no frame on any stack, so the handler
+# callbacks are also wrapped for the window to measure their wall time. Nothing is installed or
+# wrapped while profiling is off, so handlers run at full speed the rest of the time.
+def sample_stacks(session):
+    """Sample the stacks of all other threads until the session is stopped."""
+    own_thread = threading.get_ident()
+
+    while not session['stop'].wait(PROFILE_INTERVAL):
+        session['ticks'] += 1
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+
+            # The innermost frame gets self time; every distinct function on the stack gets cumulative time
+            code = frame.f_code
+            session['self'][(code.co_filename, code.co_firstlineno, code.co_name)] += 1
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                function = (code.co_filename, code.co_firstlineno, code.co_name)
+                if function not in seen:
+                    seen.add(function)
+                    session['cumulative'][function] += 1
+                frame = frame.f_back
+
+def registered_handlers(handlers):
+    """Yield the given handlers, including those nested in conversation handlers."""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from registered_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from registered_handlers(state_handlers)
+            yield from registered_handlers(handler.fallbacks)
+        else:
+            yield handler
+
+def timed_callback(session, callback):
+    """Wrap a handler callback to record its wall time, awaits included, in the session."""
+    @functools.wraps(callback)
+    async def timed(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = session['handlers'].setdefault(callback.__name__, {'calls': 0, 'total': 0.0, 'max': 0.0})
+            stats['calls'] += 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+    return timed
+
+def wrap_handlers(session, application: Application):
+    """Time every registered handler callback for the duration of the session."""
+    session['wrapped'] = []
+    for handlers in application.handlers.values():
+        for handler in registered_handlers(handlers):
+            session['wrapped'].append((handler, handler.callback))
+            handler.callback = timed_callback(session, handler.callback)
+
+def unwrap_handlers(session):
+    """Restore the handler callbacks wrapped by wrap_handlers."""
+    for handler, callback in session['wrapped']:
+        handler.callback = callback
+
+def format_profile(session, elapsed):
+    """Render the top functions by cumulative time."""
+    seconds_per_sample = elapsed / max(session['ticks'], 1)
+
+    def table(functions):
+        lines = [f"{'cumulative':>11} {'self':>9}  function"]
+        for function, samples in functions:
+            filename, line, name = function
+            lines.append(
+                f"{samples * seconds_per_sample:10.3f}s {session['self'][function] * seconds_per_sample:8.3f}s"
+                f"  {name} ({os.path.basename(filename)}:{line})"
+            )
+        return "\n".join(lines)
+
+    cumulative = session['cumulative']
+    own_functions = [item for item in cumulative.items() if item[0][0] == __file__]
+    own_functions = heapq.nlargest(PROFILE_TOP_N, own_functions, key=lambda item: item[1])
+
+    handler_lines = [f"{'total':>10} {'mean':>9} {'max':>9} {'calls':>6}  handler"]
+    for name, stats in sorted(session['handlers'].items(), key=lambda item: item[1]['total'], reverse=True):
+        handler_lines.append(
+            f"{stats['total']:9.3f}s {stats['total'] / stats['calls']:8.3f}s {stats['max']:8.3f}s "
+            f"{stats['calls']:6d}  {name}"
+        )
+    handler_table = "\n".join(handler_lines)
+
+    return (
+        f"Profile of {elapsed:.1f}s, {session['ticks']} samples every {PROFILE_INTERVAL * 1000:.0f} ms "
+        f"(times are summed over all threads)\n\n"
+        f"Handlers by wall time (including time spent awaiting the Telegram API and commits):\n"
+        f"{handler_table}\n\n"
+        f"Bot functions by cumulative sampled time (time spent awaiting is not on any stack and is not included):\n"
+        f"{table(own_functions)}\n\n"
+        f"All functions by cumulative sampled time:\n{table(cumulative.most_common(PROFILE_TOP_N))}\n"
+    )
+
+async def profile_report_job(context: ContextTypes.DEFAULT_TYPE):
+    """Stop the running profile and send its summary to the admin who started it."""
+    global profiling
+    session, profiling = profiling, None
+
+    session['stop'].set()
+    session['thread'].join()
+    unwrap_handlers(session)
+    elapsed = time.perf_counter() - session['started']
+
+    try:
+        await context.bot.send_document(
+            chat_id=context.job.chat_id,
+            document=io.BytesIO(format_profile(session, elapsed).encode()),
+            filename=f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+        )
+    except Exception as e:
+        logger.error(f"Error in profile_report_job: {e}")
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Profile the bot for a number of seconds and send the top functions (admin only)."""
+    global profiling
+
+    # Check if user is admin
+    if update.effective_user.id not in ADMIN_USERS:
+        await update.message.reply_text("This command is only available to administrators.")
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else 30
+    except ValueError:
+        await update.message.reply_text("Please provide the duration in seconds: /profile 30")
+        return
+
+    if not 1 <= seconds <= MAX_PROFILE_SECONDS:
+        await update.message.reply_text(f"The duration must be between 1 and {MAX_PROFILE_SECONDS} seconds.")
+        return
+
+    if profiling is not None:
+        await update.message.reply_text("A profile is already running. Please wait for its report.")
+        return
+
+    profiling = {
+        'stop': threading.Event(),
+        'started': time.perf_counter(),
+        'ticks': 0,
+        'self': Counter(),
+        'cumulative': Counter(),
+        'handlers': {}
+    }
+    wrap_handlers(profiling, context.application)
+    profiling['thread'] = threading.Thread(target=sample_stacks, args=(profiling,), name="profiler", daemon=True)
+    profiling['thread'].start()
+
+    context.job_queue.run_once(profile_report_job, seconds, chat_id=update.effective_chat.id)
+    await update.message.reply_text(f"⏱ Profiling for {seconds} seconds. The report will be sent as a file.")
+
+async def post_init(application: Application):
+    """Start background tasks once the application is initialized."""
+    global notification_queue, commit_queue, commit_task, full_audit_pending
+    notification_queue = asyncio.Queue()
+    for _ in range(NOTIFICATION_WORKERS):
+        notification_tasks.append(asyncio.create_task(notification_worker(application)))
+
+    # The migration writes directly, so it has to finish before the committer starts
+    ensure_excel_files_exist()
+    migrate_seat_maps()
+    commit_queue = asyncio.Queue()
+    commit_task = asyncio.create_task(group_committer())
+
+    build_reminder_heap()
+    build_report_stats()
+    application.job_queue.run_repeating(reminder_job, interval=REMINDER_CHECK_INTERVAL, first=0)
+
+    # The first integrity run is a full audit, which also builds the ledger
+    full_audit_pending = True
+    application.job_queue.run_repeating(integrity_job, interval=INTEGRITY_CHECK_INTERVAL, first=0)
+
+    # Archive once at startup in case the bot was not running at ARCHIVE_TIME
+    application.job_queue.run_once(archive_job, 0)
+    application.job_queue.run_daily(archive_job, time=ARCHIVE_TIME)
+
+async def post_shutdown(application: Application):
+    """Stop background tasks when the application shuts down."""
+    for task in notification_tasks:
+        task.cancel()
+    if commit_task:
+        commit_task.cancel()
+
 async def download_bookings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Download bookings data (admin only)."""
     ensure_excel_files_exist()
@@ -818,10 +2629,35 @@ async def download_bookings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        await update.message.reply_document(
-            document=open(BOOKINGS_FILE, 'rb'),
-            filename=BOOKINGS_FILE
-        )
+        if not context.args:
+            await update.message.reply_document(
+                document=open(BOOKINGS_FILE, 'rb'),
+                filename=BOOKINGS_FILE
+            )
+            return
+        
+        # Archived bookings: "all" for the full history or YYYY-MM for a single month
+        month = context.args[0]
+        if month == "all":
+            bookings_df = pd.concat([load_archive('bookings'), pd.read_excel(BOOKINGS_FILE)], ignore_index=True)
+        else:
+            try:
+                datetime.strptime(month, "%Y-%m")
+            except ValueError:
+                await update.message.reply_text("Invalid month format. Please use YYYY-MM or 'all'.")
+                return
+            hot_df = pd.read_excel(BOOKINGS_FILE)
+            hot_df = hot_df[pd.to_datetime(hot_df['Date']).dt.strftime("%Y-%m") == month]
+            bookings_df = pd.concat([load_archive('bookings', month), hot_df], ignore_index=True)
+        
+        if bookings_df.empty:
+            await update.message.reply_text("No bookings found for this period.")
+            return
+        
+        output = io.BytesIO()
+        bookings_df.to_excel(output, index=False)
+        output.seek(0)
+        await update.message.reply_document(document=output, filename=f"bookings-{month}.xlsx")
     except Exception as e:
         logger.error(f"Error in download_bookings: {e}")
         await update.message.reply_text(f"Error sending bookings file: {e}")
@@ -834,7 +2670,13 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 def main():
     """Start the bot."""
     # Create the Application
-    application = Application.builder().token("7800384128:AAFz1oFxkJfCojXgQ1KDve5i3XCshjqPhak").build()
+    application = (
+        Application.builder()
+        .token("7800384128:AAFz1oFxkJfCojXgQ1KDve5i3XCshjqPhak")
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Add conversation handler for booking
     booking_conv_handler = ConversationHandler(
@@ -842,6 +2684,8 @@ def main():
         states={
             SELECTING_DATE: [CallbackQueryHandler(select_date)],
             SELECTING_FLIGHT: [CallbackQueryHandler(select_flight)],
+            SELECTING_SEATS: [CallbackQueryHandler(select_seats)],
+            PICKING_SEAT: [CallbackQueryHandler(pick_seat)],
             CONFIRMING_BOOKING: [CallbackQueryHandler(confirm_booking)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
@@ -870,7 +2714,13 @@ def main():
     application.add_handler(CommandHandler("my_bookings", my_bookings))
     application.add_handler(CommandHandler("available", show_available_flights))
     application.add_handler(CommandHandler("remove_flight", remove_flight))
+    application.add_handler(CommandHandler("force_remove_flight", force_remove_flight))
+    application.add_handler(CommandHandler("cancel_route", cancel_route))
+    application.add_handler(CommandHandler("cancel_dates", cancel_dates))
     application.add_handler(CommandHandler("download_bookings", download_bookings))
+    application.add_handler(CommandHandler("report", report))
+    application.add_handler(CommandHandler("profile", profile))
+    application.add_handler(CommandHandler("integrity", integrity))
     application.add_handler(CommandHandler("recreate_excel", recreate_excel_files))
     
     application.add_handler(booking_conv_handler)